@@ -0,0 +1,118 @@
+"""Batch rendering of many profiles with the same plot settings.
+
+Each profile runs the whole pipeline in a worker process on the Agg
+backend; the results come back in input order as a zip of figures or a
+multi-page PDF.
+"""
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_pdf import PdfPages
+
+from cache import LRUCache
+from pipeline import export_figure, prepare_section, render_figure, section_contours
+
+BATCH_FORMATS = ('zip', 'pdf')
+
+# Suffix added to electrode tables by create_electrode_elevation.py
+ELEVATION_SUFFIX = '-elevation'
+
+
+def pair_profiles(data_tables, electrode_tables):
+    """Pairs data and electrode tables, both {file stem: frame}, by stem.
+
+    An electrode table matches the data file with the same stem, with or
+    without the -elevation suffix. Returns ([(stem, data, electrodes)]
+    sorted by stem, [stems of data files without electrodes]).
+    """
+    electrodes = {stem.removesuffix(ELEVATION_SUFFIX): table
+                  for stem, table in electrode_tables.items()}
+    pairs, unpaired = [], []
+    for stem in sorted(data_tables):
+        if stem in electrodes:
+            pairs.append((stem, data_tables[stem], electrodes[stem]))
+        else:
+            unpaired.append(stem)
+    return pairs, unpaired
+
+
+def shared_value_range(profiles):
+    """Resistivity range over all profiles, for a common colour scale."""
+    rho = [values[:, 2] for _, values, _ in profiles]
+    return float(min(r.min() for r in rho)), float(max(r.max() for r in rho))
+
+
+def _init_worker():
+    matplotlib.use('Agg')
+
+
+def _profile_contours(values, settings, value_range):
+    # every worker starts from empty caches; nothing is shared between profiles
+    section = prepare_section(values)
+    contours = section_contours(
+        section, settings['mask_alpha'], settings['smoothing'],
+        settings['number_of_contours'], LRUCache(), LRUCache(), value_range)
+    return section, contours
+
+
+def _render_profile(name, values, electrodes, settings, value_range, file_format, dpi):
+    section, contours = _profile_contours(values, settings, value_range)
+    fig = render_figure(section, contours, electrodes, settings, name)
+    return export_figure(fig, file_format, dpi)
+
+
+def _map(fn, workers, *iterables):
+    if workers == 1:
+        _init_worker()
+        return list(map(fn, *iterables))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        return list(executor.map(fn, *iterables))
+
+
+def render_profiles(profiles, settings, file_format='png', dpi=300,
+                    shared_scale=False, workers=None):
+    """Renders every (name, values, electrodes) profile to `file_format` bytes, in order."""
+    n = len(profiles)
+    value_range = shared_value_range(profiles) if shared_scale else None
+    return _map(_render_profile, workers,
+                [name for name, _, _ in profiles],
+                [values for _, values, _ in profiles],
+                [electrodes for _, _, electrodes in profiles],
+                [settings] * n, [value_range] * n, [file_format] * n, [dpi] * n)
+
+
+def render_batch(profiles, settings, bundle='zip', file_format='png', dpi=300,
+                 shared_scale=False, workers=None):
+    """Renders every (name, values, electrodes) profile and bundles the results.
+
+    `values` holds the x, elevation and resistivity columns and `settings`
+    is a dict of the pipeline.RENDER_SETTINGS keys or a render.PlotSettings.
+    `bundle` is 'zip' (one `file_format` file per profile) or 'pdf' (one
+    page per profile). Returns the bundle bytes.
+    """
+    n = len(profiles)
+
+    buffer = BytesIO()
+    if bundle == 'pdf':
+        # the expensive stages run in parallel; pages are styled and written here
+        value_range = shared_value_range(profiles) if shared_scale else None
+        stages = _map(_profile_contours, workers, [v for _, v, _ in profiles],
+                      [settings] * n, [value_range] * n)
+        with PdfPages(buffer) as pdf:
+            for (name, _, electrodes), (section, contours) in zip(profiles, stages):
+                fig = render_figure(section, contours, electrodes, settings, name)
+                pdf.savefig(fig, bbox_inches='tight', pad_inches=0.2, dpi=dpi)
+    else:
+        images = render_profiles(profiles, settings, file_format, dpi, shared_scale, workers)
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for (name, _, _), image in zip(profiles, images):
+                archive.writestr(f"{name}.{file_format}", image)
+    return buffer.getvalue()
+
+
+def profile_values(df):
+    """The x, elevation and resistivity columns of a data table as floats."""
+    return np.asarray(df.iloc[:, :3].to_numpy(dtype=float))
@@ -0,0 +1,119 @@
+"""Memory and output of the compact (float32) data path against the default one.
+
+For each size, writes a synthetic model-cell table with extra columns,
+reads it with read_table_bytes (every column, float64) and with
+read_section_bytes (three columns, float32), and reports the bytes each
+frame keeps, the parse peak, the bytes the section and the cached
+geometry and contours hold, and how far apart the rendered PNGs are.
+
+A third, "rounded" run renders the float64 path on the values rounded to
+float32. Compact against rounded isolates the float32 arithmetic; full
+against rounded is what the 7-digit rounding of the input alone changes,
+which on noisy sections is mostly where labels land on small contour
+islands.
+
+Usage: python benchmarks/bench_compact.py [--sizes 100000 500000] [--format parquet]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import tracemalloc
+from io import BytesIO
+
+import matplotlib
+import numpy as np
+
+matplotlib.use('Agg')
+import matplotlib.image as mpimg  # noqa: E402
+import matplotlib.pyplot as plt  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cache import LRUCache  # noqa: E402
+from loaders import read_section_bytes, read_table_bytes  # noqa: E402
+from pipeline import export_figure, prepare_section, render_figure, section_contours  # noqa: E402
+from render import PlotSettings  # noqa: E402
+from synthetic import synthetic_electrodes, write_table  # noqa: E402
+
+
+def read_rounded(data, extension):
+    return read_table_bytes(data, extension).astype(np.float32).astype(float)
+
+
+PATHS = {'full': read_table_bytes, 'compact': read_section_bytes, 'rounded': read_rounded}
+
+
+def traced(fn):
+    """Returns (result, tracemalloc peak bytes of one run)."""
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak
+
+
+def run_path(data, fmt, reader, electrodes, settings):
+    frame, parse_peak = traced(lambda: reader(data, fmt))
+    section = prepare_section(frame.iloc[:, :3].to_numpy())
+    geometry_cache, stage_cache = LRUCache(), LRUCache()
+    contours = section_contours(section, settings.mask_alpha, settings.smoothing,
+                                settings.number_of_contours, geometry_cache, stage_cache)
+    fig = render_figure(section, contours, electrodes, settings, 'compact benchmark')
+    image = mpimg.imread(BytesIO(export_figure(fig, 'png', settings.figure_dpi)))
+    plt.close(fig)
+    return {
+        'frame': int(frame.memory_usage(deep=True).sum()),
+        'parse_peak': parse_peak,
+        'section': section.x.nbytes + section.z.nbytes + section.rho.nbytes,
+        'caches': geometry_cache.nbytes + stage_cache.nbytes,
+        'no_copy': np.shares_memory(section.x, frame.to_numpy()),
+        'levels': contours.levels,
+        'image': image,
+    }
+
+
+def compare(a, b):
+    levels = np.max(np.abs(b['levels'] / a['levels'] - 1))
+    if a['image'].shape != b['image'].shape:
+        return f"levels max rel. diff {levels:.1e}, image sizes differ"
+    diff = np.abs(a['image'] - b['image']).max(axis=-1)
+    return (f"levels max rel. diff {levels:.1e}, pixels differing {np.mean(diff > 0):.3%}, "
+            f"max channel diff {diff.max():.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 500_000])
+    parser.add_argument('--format', default='parquet', choices=['xlsx', 'csv', 'parquet', 'feather'])
+    parser.add_argument('--extra-columns', type=int, default=3,
+                        help="Columns after x, elevation and resistivity in the table.")
+    parser.add_argument('--smoothing', type=float, default=0.0)
+    parser.add_argument('--dpi', type=int, default=100)
+    args = parser.parse_args()
+
+    settings = PlotSettings(smoothing=args.smoothing, figure_dpi=args.dpi)
+    print(f"{'points':>8} {'path':<8} {'frame MiB':>10} {'parse peak':>10} "
+          f"{'section':>8} {'caches':>8} {'view':>5}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            path = write_table(os.path.join(workdir, f"section-{n}.{args.format}"), n,
+                               args.format, extra_columns=args.extra_columns)
+            with open(path, 'rb') as f:
+                data = f.read()
+            electrodes = synthetic_electrodes(n)
+            results = {}
+            for name, reader in PATHS.items():
+                r = results[name] = run_path(data, args.format, reader, electrodes, settings)
+                print(f"{n:>8} {name:<8} {r['frame'] / 2**20:>10.2f} "
+                      f"{r['parse_peak'] / 2**20:>10.2f} {r['section'] / 2**20:>8.2f} "
+                      f"{r['caches'] / 2**20:>8.2f} {str(r['no_copy']):>5}")
+
+            for a, b in (('full', 'compact'), ('rounded', 'compact'), ('full', 'rounded')):
+                print(f"{'':>8} {a} vs {b}: {compare(results[a], results[b])}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
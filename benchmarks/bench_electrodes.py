@@ -0,0 +1,66 @@
+"""Electrode deduplication on large surveys: legacy my_fun vs unique_electrodes.
+
+Usage: python benchmarks/bench_electrodes.py [--quadrupoles 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_electrode_elevation import my_fun  # noqa: E402
+
+
+def legacy_my_fun(df_new, electrode, elevation):
+    df_new['electrode'] = electrode
+    df_new['elevation'] = elevation
+    df_new['elevation'] = pd.to_numeric(df_new['elevation'], errors='coerce')
+    df_new.drop_duplicates(subset=['elevation'], keep='first', inplace=True)
+    df_new.sort_values(by=['electrode'], inplace=True, ascending=True)
+    df_new.reset_index(drop=True, inplace=True)
+    return df_new
+
+
+def survey(quadrupoles, electrodes=96, spacing=2.0, seed=0):
+    """Raveled A, B, M, N positions and elevations of a random survey.
+
+    Elevations come from a terraced topography, so some neighbouring
+    electrodes share an elevation as they do on flat ground.
+    """
+    rng = np.random.default_rng(seed)
+    index = np.sort(rng.integers(0, electrodes, (quadrupoles, 4)), axis=1)
+    positions = index * spacing
+    elevations = np.round(100 + 3 * np.sin(positions / 40), 1)
+    return positions.ravel(), elevations.ravel(), electrodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quadrupoles', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'quadrupoles':>12} {'legacy (s)':>11} {'rows':>6} {'new (s)':>9} {'rows':>6} {'electrodes':>11}")
+    for n in args.quadrupoles:
+        electrode, elevation, expected = survey(n)
+        columns = ["electrode", "elevation"]
+
+        start = time.perf_counter()
+        legacy = legacy_my_fun(pd.DataFrame(columns=columns), electrode, elevation)
+        legacy_t = time.perf_counter() - start
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            start = time.perf_counter()
+            new = my_fun(pd.DataFrame(columns=columns), electrode, elevation)
+            new_t = time.perf_counter() - start
+
+        print(f"{n:>12} {legacy_t:>11.3f} {len(legacy):>6} {new_t:>9.3f} {len(new):>6} {expected:>11}")
+
+
+if __name__ == '__main__':
+    main()
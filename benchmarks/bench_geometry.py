@@ -0,0 +1,44 @@
+"""Rerun latency of the geometry stage with and without the triangulation cache.
+
+Usage: python benchmarks/bench_geometry.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache  # noqa: E402
+from geometry import build_triangulation  # noqa: E402
+from synthetic import synthetic_section  # noqa: E402
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'uncached (s)':>14} {'cached (s)':>12} {'speedup':>9}")
+    for n in args.sizes:
+        x, z, _ = synthetic_section(n)
+        cache = LRUCache(max_entries=4)
+        uncached = best_of(lambda: build_triangulation(x, z, alpha=10), args.repeat)
+        build_triangulation(x, z, alpha=10, cache=cache)  # warm the cache
+        cached = best_of(lambda: build_triangulation(x, z, alpha=10, cache=cache), args.repeat)
+        print(f"{x.size:>10} {uncached:>14.4f} {cached:>12.4f} {uncached / cached:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Time and peak memory of the edge-length mask on large meshes.
+
+Compares the original apply_mask computation (fancy indexing inside
+np.roll, sqrt of every side) with geometry.edge_length_mask.
+
+Usage: python benchmarks/bench_mask.py [--sizes 100000 1000000 10000000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geometry import edge_length_mask  # noqa: E402
+
+
+def legacy_mask(x, z, triangles, alpha):
+    xtri = x[triangles] - np.roll(x[triangles], 1, axis=1)
+    ytri = z[triangles] - np.roll(z[triangles], 1, axis=1)
+    maxi = np.max(np.sqrt(xtri**2 + ytri**2), axis=1)
+    return maxi > alpha
+
+
+def measure(fn, *args):
+    """Returns (result, seconds, peak MiB allocated while running fn)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--alpha', type=float, default=10.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'triangles':>10} {'legacy (s)':>11} {'legacy MiB':>11} "
+          f"{'new (s)':>9} {'new MiB':>9}")
+    for ntri in args.sizes:
+        npts = ntri // 2
+        x = rng.uniform(0, 1000, npts)
+        z = rng.uniform(0, 100, npts)
+        # Neighbouring vertex indices, so most sides are short as in a real mesh
+        base = rng.integers(0, npts - 64, ntri)
+        triangles = base[:, None] + rng.integers(0, 64, (ntri, 3))
+        x.sort()
+
+        expected, legacy_t, legacy_mem = measure(legacy_mask, x, z, triangles, args.alpha)
+        actual, new_t, new_mem = measure(edge_length_mask, x, z, triangles, args.alpha)
+        assert np.array_equal(expected, actual)
+        print(f"{ntri:>10} {legacy_t:>11.3f} {legacy_mem:>11.1f} "
+              f"{new_t:>9.3f} {new_mem:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
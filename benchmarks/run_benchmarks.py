@@ -0,0 +1,235 @@
+"""Benchmark suite: time and peak memory of every pipeline stage.
+
+Generates synthetic model-cell tables and .INV files (see synthetic.py),
+runs the plotting pipeline of main.py and the electrode extraction of
+create_electrode_elevation.py stage by stage, and writes the results as
+JSON. Pass --compare with the JSON of an earlier commit to list the
+stages that got slower.
+
+Usage: python benchmarks/run_benchmarks.py [--sizes 10000 100000] [-o results.json]
+                                           [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import scipy
+
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cache import LRUCache  # noqa: E402
+from create_electrode_elevation import OUTPUT_FORMATS, electrode_table  # noqa: E402
+from inv_reader import read_inv  # noqa: E402
+from loaders import read_table_bytes  # noqa: E402
+from pipeline import (PREVIEW_POINT_BUDGET, build_geometry,  # noqa: E402
+                      decimate_section, export_figure, extract_contours,
+                      prepare_section, render_figure, smooth_on_grid)
+from render import PlotSettings  # noqa: E402
+from synthetic import synthetic_electrodes, write_inv, write_table  # noqa: E402
+
+# (columns, topography) of the .INV layouts
+INV_LAYOUTS = [(8, True), (8, False), (10, True), (10, False)]
+
+
+def measure(fn, repeat=1, memory=True):
+    """Returns (result, best seconds of `repeat` runs, peak bytes or None).
+
+    The peak is what Python and NumPy allocated during one extra run under
+    tracemalloc, kept separate so tracing does not inflate the timings.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, min(times), peak
+
+
+class Recorder:
+    """Collects one result record per (suite, stage, parameters)."""
+
+    def __init__(self, repeat, memory):
+        self.repeat = repeat
+        self.memory = memory
+        self.results = []
+
+    def run(self, suite, stage, params, fn):
+        result, seconds, peak = measure(fn, self.repeat, self.memory)
+        self.results.append({'suite': suite, 'stage': stage, 'params': params,
+                             'seconds': seconds, 'peak_bytes': peak})
+        peak_text = f"{peak / 2**20:>9.1f}" if peak is not None else f"{'-':>9}"
+        print(f"{suite:<10} {stage:<16} {format_params(params):<44} "
+              f"{seconds:>9.4f} {peak_text}", flush=True)
+        return result
+
+
+def format_params(params):
+    return " ".join(f"{k}={v}" for k, v in params.items())
+
+
+def plot_suite(recorder, workdir, sizes, smoothings, contours, table_formats):
+    settings = PlotSettings()
+    for n in sizes:
+        electrodes = synthetic_electrodes(n)
+        for fmt in table_formats:
+            path = write_table(os.path.join(workdir, f"section-{n}.{fmt}"), n, fmt)
+            with open(path, 'rb') as f:
+                data = f.read()
+            table = recorder.run('plot', f'read_{fmt}', {'points': n},
+                                 lambda: read_table_bytes(data, fmt))
+
+        values = table.iloc[:, :3].to_numpy(dtype=float)
+        section = recorder.run('plot', 'prepare', {'points': n},
+                               lambda: prepare_section(values))
+        recorder.run('plot', 'decimate', {'points': n, 'budget': PREVIEW_POINT_BUDGET},
+                     lambda: decimate_section(section, PREVIEW_POINT_BUDGET, LRUCache()))
+        geometry = recorder.run('plot', 'geometry', {'points': n, 'alpha': settings.mask_alpha},
+                                lambda: build_geometry(section, settings.mask_alpha, LRUCache()))
+
+        for sigma in smoothings:
+            grid = None
+            if sigma > 0:
+                grid = recorder.run('plot', 'smooth', {'points': n, 'smoothing': sigma},
+                                    lambda: smooth_on_grid(section, geometry, sigma, LRUCache()))
+            for number in contours:
+                params = {'points': n, 'smoothing': sigma, 'contours': number}
+                extracted = recorder.run(
+                    'plot', 'contours', params,
+                    lambda: extract_contours(section, geometry, number, LRUCache(), grid=grid))
+                style = PlotSettings(smoothing=sigma, number_of_contours=number)
+                fig = recorder.run(
+                    'plot', 'render', params,
+                    lambda: render_figure(section, extracted, electrodes, style, 'benchmark'))
+                for file_format in ('png', 'svg'):
+                    recorder.run('plot', f'export_{file_format}', params,
+                                 lambda: export_figure(fig, file_format, settings.figure_dpi))
+                plt.close(fig)
+
+
+def electrode_suite(recorder, workdir, measurements, output_formats):
+    for n in measurements:
+        for columns, topo in INV_LAYOUTS:
+            layout = f"{columns}col-{'topo' if topo else 'notopo'}"
+            path = write_inv(os.path.join(workdir, f"survey-{n}-{layout}.INV"), n,
+                             columns=columns, topo=topo)
+            params = {'measurements': n, 'layout': layout}
+            inv = recorder.run('electrodes', 'read_inv', params, lambda: read_inv(path))
+            table = recorder.run('electrodes', 'electrode_table', params,
+                                 lambda: electrode_table(inv))
+            for fmt in output_formats:
+                extension, writer = OUTPUT_FORMATS[fmt]
+                out = os.path.join(workdir, f"survey-{n}-{layout}-elevation{extension}")
+                recorder.run('electrodes', f'write_{fmt}', params, lambda: writer(table, out))
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scipy': scipy.__version__,
+        'matplotlib': matplotlib.__version__,
+    }
+
+
+def result_key(record):
+    return record['suite'], record['stage'], json.dumps(record['params'], sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """Prints the time ratio of every stage also in `baseline`; returns the regressions."""
+    previous = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})")
+    print(f"{'suite':<10} {'stage':<16} {'parameters':<44} {'before':>9} {'after':>9} {'ratio':>7}")
+    for record in results:
+        old = previous.get(result_key(record))
+        if old is None:
+            continue
+        ratio = record['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+        flag = " slower" if ratio > threshold else ""
+        if flag:
+            regressions.append(record)
+        print(f"{record['suite']:<10} {record['stage']:<16} {format_params(record['params']):<44} "
+              f"{old['seconds']:>9.4f} {record['seconds']:>9.4f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000],
+                        help="Model cells per synthetic section.")
+    parser.add_argument('--smoothing', type=float, nargs='+', default=[0.0, 2.0])
+    parser.add_argument('--contours', type=int, nargs='+', default=[20, 50])
+    parser.add_argument('--table-formats', nargs='+', default=['xlsx', 'parquet'],
+                        choices=['xlsx', 'csv', 'parquet', 'feather'],
+                        help="Upload formats whose parsing is timed; the last one feeds the pipeline.")
+    parser.add_argument('--measurements', type=int, nargs='+', default=[10_000, 100_000],
+                        help="Measurement rows per synthetic .INV file.")
+    parser.add_argument('--output-formats', nargs='+', default=['xlsx', 'parquet'],
+                        choices=list(OUTPUT_FORMATS))
+    parser.add_argument('--suite', choices=['plot', 'electrodes', 'all'], default='all')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Runs per stage; the fastest is reported.")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Skip the extra traced run that measures peak memory.")
+    parser.add_argument('-o', '--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help="Results JSON of an earlier run to compare with.")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="Ratio above which a stage counts as a regression.")
+    args = parser.parse_args()
+
+    recorder = Recorder(args.repeat, not args.no_memory)
+    print(f"{'suite':<10} {'stage':<16} {'parameters':<44} {'seconds':>9} {'peak MiB':>9}")
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.suite in ('plot', 'all'):
+            plot_suite(recorder, workdir, args.sizes, args.smoothing, args.contours,
+                       args.table_formats)
+        if args.suite in ('electrodes', 'all'):
+            electrode_suite(recorder, workdir, args.measurements, args.output_formats)
+
+    output = {'meta': metadata(), 'repeat': args.repeat, 'results': recorder.results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+    print(f"\nWrote {len(recorder.results)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(recorder.results, baseline, args.threshold)
+        print(f"{len(regressions)} stages slower than {args.threshold:g}x the baseline")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
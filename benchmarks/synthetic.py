@@ -0,0 +1,127 @@
+"""Synthetic ERT inputs at configurable sizes, for the benchmarks.
+
+synthetic_section and write_table produce model-cell tables as read by
+main.py; write_inv produces RES2DINV-style .INV files as read by
+create_electrode_elevation.py, in the 8- (A, M, N) and 10-column
+(A, B, M, N) layouts, with or without a topography section.
+"""
+import numpy as np
+import pandas as pd
+
+# Model-cell table formats write_table can produce, by file extension
+TABLE_WRITERS = {
+    'xlsx': lambda df, path: df.to_excel(path, index=False),
+    'csv': lambda df, path: df.to_csv(path, index=False),
+    'parquet': lambda df, path: df.to_parquet(path, index=False),
+    'feather': lambda df, path: df.to_feather(path),
+}
+
+
+def topography(x):
+    """Gently undulating ground elevation at positions `x`."""
+    return 100 + 5 * np.sin(x / 50)
+
+
+def synthetic_section(n_points, seed=0, spacing=0.5):
+    """Returns (x, z, rho) for a synthetic ERT model-cell section.
+
+    Cells sit on a regular grid of columns under a gently undulating
+    topography, with layer thickness growing with depth as in a typical
+    inversion model. The section is about 20 times wider than it has
+    layers, so its depth stays around a fifth of the spread at any size.
+    Resistivity is a smooth log-normal field with a conductive anomaly.
+    """
+    rng = np.random.default_rng(seed)
+    nx = max(int(np.sqrt(n_points * 20)), 2)
+    nz = max(n_points // nx, 2)
+
+    x_col = np.arange(nx) * spacing
+    thickness = np.minimum(spacing * 1.05 ** np.arange(nz), 4 * spacing)
+    depth = np.cumsum(thickness)
+
+    x = np.repeat(x_col, nz)
+    surface = topography(x)
+    z = surface - np.tile(depth, nx)
+    x = x + rng.uniform(-0.05, 0.05, x.size) * spacing
+
+    log_rho = 2 + 0.5 * np.sin(x / 30) + 0.3 * np.cos((surface - z) / 10)
+    centre = x_col[nx // 2], 100 - depth[nz // 3]
+    log_rho -= 1.0 * np.exp(-((x - centre[0])**2 + (z - centre[1])**2) / (2 * (10 * spacing)**2))
+    rho = 10 ** (log_rho + rng.normal(0, 0.02, x.size))
+    return x, z, rho
+
+
+def synthetic_electrodes(n_points, spacing=0.5, electrode_spacing=2.0):
+    """(electrode, elevation) table spanning the section of synthetic_section."""
+    width = (max(int(np.sqrt(n_points * 20)), 2) - 1) * spacing
+    positions = np.arange(0, width + electrode_spacing / 2, electrode_spacing)
+    return pd.DataFrame({'electrode': positions, 'elevation': topography(positions)})
+
+
+def write_table(path, n_points, fmt='xlsx', seed=0, extra_columns=0):
+    """Writes a synthetic model-cell table (x, elevation, resistivity) to `path`.
+
+    `extra_columns` appends that many further columns, like the
+    sensitivity and conductivity columns of an inversion export.
+    """
+    x, z, rho = synthetic_section(n_points, seed=seed)
+    df = pd.DataFrame({'x': x, 'elevation': z, 'resistivity': rho})
+    for i in range(extra_columns):
+        df[f'extra_{i}'] = rho * (i + 2)
+    TABLE_WRITERS[fmt](df, path)
+    return path
+
+
+def synthetic_measurements(n_measurements, n_electrodes=96, columns=8,
+                           spacing=2.0, seed=0):
+    """Measurement block of a survey: (n, columns) rows as in a .INV file.
+
+    Each row holds the number of electrodes, then position and elevation
+    of A, M, N (8 columns) or A, B, M, N (10 columns), then the apparent
+    resistivity.
+    """
+    rng = np.random.default_rng(seed)
+    n_electrodes_used = 3 if columns == 8 else 4
+    # sorted random electrodes, so A < (B <) M < N as in a real array
+    index = np.sort(rng.integers(0, n_electrodes, (n_measurements, n_electrodes_used)), axis=1)
+    positions = index * spacing
+    elevations = np.round(topography(positions), 3)
+
+    rows = np.empty((n_measurements, columns))
+    rows[:, 0] = n_electrodes_used
+    rows[:, 1:-1:2] = positions
+    rows[:, 2:-1:2] = elevations
+    rows[:, -1] = 10 ** rng.normal(2, 0.3, n_measurements)
+    return rows
+
+
+def write_inv(path, n_measurements, n_electrodes=96, columns=8, topo=True,
+              spacing=2.0, seed=0):
+    """Writes a RES2DINV-style .INV file with the layout inv_reader.py expects.
+
+    With `topo` the file ends with a TOPOGRAPHICAL DATA section listing
+    every electrode; without it, elevations come only from the
+    measurement rows.
+    """
+    rows = synthetic_measurements(n_measurements, n_electrodes, columns, spacing, seed)
+    header = [
+        "Synthetic profile",
+        f"{spacing:g}",
+        "11",
+        "0",
+        "Type of measurement (0=app. resistivity,1=resistance)",
+        "0",
+        str(n_measurements),
+        "1",
+        "0",
+    ]
+    fmt = ["%d"] + ["%.3f"] * (columns - 1)
+    with open(path, 'w') as f:
+        f.write("\n".join(header) + "\n")
+        np.savetxt(f, rows, fmt=fmt)
+        if topo:
+            positions = np.arange(n_electrodes) * spacing
+            f.write(f"Topography in separate list\nTOPOGRAPHICAL DATA\n2\n{n_electrodes}\n")
+            np.savetxt(f, np.column_stack([positions, topography(positions)]), fmt="%.3f")
+        f.write("0\n0\n0\n0\n")
+    return path
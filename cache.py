@@ -0,0 +1,216 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def content_hash(data):
+    """Returns a short hex digest of raw bytes, used as a cache key."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def array_fingerprint(*arrays, extra=()):
+    """Returns a digest of the dtype, shape and content of NumPy arrays.
+
+    `extra` holds plain parameters (e.g. thresholds) that belong in the key.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(str((a.dtype.str, a.shape)).encode())
+        h.update(a.tobytes())
+    h.update(repr(tuple(extra)).encode())
+    return h.hexdigest()
+
+
+def estimate_nbytes(value):
+    """Best-effort size in bytes of a cached value."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    return 0
+
+
+class DiskStore:
+    """Pickled values in a directory, bounded by total bytes.
+
+    Used as a second tier behind LRUCache: values evicted from memory, or
+    computed by another process, are reloaded from here instead of being
+    recomputed. The least recently used files are deleted first.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, content_hash(repr(key).encode()) + '.pkl')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        os.utime(self._path(key))
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        # write-then-rename so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def nbytes(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                   if entry.name.endswith('.pkl'))
+
+    def _evict(self):
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path)
+                   for e in os.scandir(self.directory) if e.name.endswith('.pkl')]
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by entry count and total bytes.
+
+    Keeps hit/miss/eviction counters so the app can report how effective
+    the cache is. It is safe to share between threads, e.g. Streamlit
+    sessions: concurrent get_or_compute calls for the same key compute the
+    value once. With a `disk` DiskStore, values also persist on disk and
+    memory misses are looked up there before computing.
+
+    Cached values are shared, so callers must not modify them.
+    """
+
+    def __init__(self, max_entries=8, max_bytes=None, disk=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+        self._pending = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            size = estimate_nbytes(value)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Never cache something that would evict everything else
+                return value
+            self._data[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            self._evict()
+            return value
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for `key`, calling `compute()` on a miss."""
+        with self._lock:
+            if key in self._data:
+                return self.get(key)
+            # the first caller computes, and counts the miss; others wait
+            # for its result, which counts as a hit
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                self.misses += 1
+                pending = self._pending[key] = threading.Lock()
+                pending.acquire()
+
+        if not owner:
+            with pending:
+                pass
+            with self._lock:
+                if key in self._data:
+                    return self.get(key)
+            # the owner failed or the value was too large to keep
+            return self.get_or_compute(key, compute)
+
+        try:
+            value = self.disk.get(key) if self.disk is not None else None
+            if value is None:
+                value = compute()
+                if self.disk is not None:
+                    self.disk.put(key, value)
+            return self.put(key, value)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.release()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._data),
+                "bytes": self.nbytes,
+                "disk_hits": self.disk.hits if self.disk is not None else 0,
+            }
+
+    def _remove(self, key):
+        del self._data[key]
+        self.nbytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
@@ -1,6 +1,17 @@
+import argparse
+import hashlib
+import json
 import os
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import quote
+
+import numpy as np
 import pandas as pd
 
+from inv_reader import electrode_positions, read_inv
+
 
 def read_inv_files(directory="."):
     inv_files = []
@@ -11,115 +22,305 @@ def read_inv_files(directory="."):
                 file_path = os.path.join(root, file)
                 inv_files.append(file_path)
 
-    return inv_files
+    # Sorted so batch runs process and report files in a deterministic order
+    return sorted(inv_files)
 
-# Create an empty DataFrame to store results
 
+def unique_electrodes(electrode, elevation, tolerance=1e-3):
+    """Reduces raveled electrode/elevation arrays to one elevation per electrode.
 
-def my_fun(df_new, electrode, elevation):
-    df_new['electrode'] = electrode
-    df_new['elevation'] = elevation
-
-    # convert the elevation column to numeric
+    Returns (positions, elevations, conflicts): sorted unique positions,
+    the first valid elevation listed for each, and the positions listed
+    with elevations that differ by more than `tolerance`.
+    """
+    electrode = np.asarray(electrode, dtype=float).ravel()
+    elevation = np.asarray(elevation).ravel()
+    if elevation.dtype.kind in 'fiu':
+        elevation = elevation.astype(float, copy=False)
+    else:
+        elevation = pd.to_numeric(pd.Series(elevation), errors='coerce').to_numpy(float)
 
-    df_new['elevation'] = pd.to_numeric(df_new['elevation'], errors='coerce')
+    keep = ~np.isnan(electrode)
+    electrode = electrode[keep]
+    elevation = elevation[keep]
 
-    # drop row if any of the values in elevation column is not unique
+    missing = np.isnan(elevation)
+    if missing.any():
+        # valid elevations first, so the first occurrence is a valid one
+        # wherever an electrode has one
+        order = np.argsort(missing, kind='stable')
+        electrode = electrode[order]
+        elevation = elevation[order]
 
-    df_new.drop_duplicates(subset=['elevation'], keep='first', inplace=True)
+    # hash-based, O(n): codes number the positions in order of first
+    # appearance, so the first occurrences are where the running max grows
+    codes, positions = pd.factorize(electrode)
+    first = np.flatnonzero(np.diff(np.maximum.accumulate(codes), prepend=-1) > 0)
+    elevations = elevation[first]
 
-    # sort the df by elevation
+    conflicting = np.abs(elevation - elevations[codes]) > tolerance
+    has_conflict = np.bincount(codes[conflicting], minlength=len(positions)) > 0
 
-    df_new.sort_values(by=['electrode'], inplace=True, ascending=True)
+    order = np.argsort(positions)
+    return positions[order], elevations[order], np.sort(positions[has_conflict])
 
-    df_new.reset_index(drop=True, inplace=True)
 
+def my_fun(df_new, electrode, elevation):
+    # one row per electrode position, sorted by electrode; electrodes that
+    # merely share an elevation are kept
+    positions, elevations, conflicts = unique_electrodes(electrode, elevation)
+
+    if conflicts.size:
+        shown = ", ".join(f"{c:g}" for c in conflicts[:10])
+        more = f" and {conflicts.size - 10} more" if conflicts.size > 10 else ""
+        warnings.warn(f"{conflicts.size} electrodes listed with different elevations "
+                      f"({shown}{more}); keeping the first elevation of each")
+
+    df_new = pd.DataFrame({'electrode': positions, 'elevation': elevations},
+                          columns=df_new.columns)
     return df_new
 
 
-# Example usage:
-# You can specify the directory path if needed
-current_directory = r"C:\Users\kalho\Downloads\Processed_Data\Inversion"
-inv_files = read_inv_files(current_directory)
-
-topo_files = {}
-for inv_file in inv_files:
-    with open(inv_file, 'r') as f:
-        # check if there is a lines that has "TOPOGRAPHICAL DATA"
-        for i, line in enumerate(f):
-            if "TOPOGRAPHICAL DATA" in line:
-                topo_files[os.path.basename(inv_file)] = True
-                break
-            else:
-                topo_files[os.path.basename(inv_file)] = False
-
-
-# Process each file and update the result table
-for inv_file in inv_files:
-
-    print(f"Processing file: {inv_file}")
-    if topo_files[os.path.basename(inv_file)] == True:
-        # find the line number of "TOPOGRAPHICAL DATA"
-        with open(inv_file, 'r') as f:
-            for i, line in enumerate(f):
-                if "TOPOGRAPHICAL DATA" in line:
-                    line_number = i
-                    # skip two line and read the number of rows
-                    for j in range(1):
-                        next(f)
-                    nrows_value = int(next(f).strip())
-                    print(nrows_value)
-                    break
-                    # nrows_value = int(next(f).strip())
-                    # print(nrows_value)
-                    # break
-            # Read the CSV file using pandas, starting from row line_number+2 and using the obtained nrows_value
-            # set column names as [electrode, elevation]
-            df_new = pd.read_csv(inv_file, sep='\s+', header=None, skiprows=line_number + 3, nrows=nrows_value, engine='python',
-                                 names=["electrode", "elevation"])
-
-    else:
-
-        # Read the CSV file using pandas to get the value from row 7
-        with open(inv_file, 'r') as f:
-            for i, line in enumerate(f):
-                if i == 6:  # Assuming the row number is 7 (0-indexed)
-                    nrows_value = int(line.strip())
-                    break
-
-        # Read the CSV file using pandas, starting from row 10 and using the obtained nrows_value
-        df = pd.read_csv(inv_file, sep='\s+', header=None,
-                         skiprows=9, nrows=nrows_value, engine='python')
-
-        # check number of columns
-        if len(df.columns) == 8:
-            df.columns = ["electrode_number", "A", "A_ele",
-                          "M", "M_elv", "N", "N_elv", "app_res"]
-            # drop "electrode_number" and "app_res" columns
-            df.drop(["electrode_number", "app_res"], axis=1, inplace=True)
-
-            df_new = pd.DataFrame(columns=["electrode", "elevation"])
-            electrode = df[['A', 'M', 'N']].values.ravel()
-            elevation = df[['A_ele', 'M_elv', 'N_elv']].values.ravel()
-            df_new = my_fun(df_new, electrode, elevation)
-
-        elif len(df.columns) == 10:
-            df.columns = ["electrode_number", "A", "A_ele", "B",
-                          "B_elv", "M", "M_elv", "N", "N_elv", "app_res"]
-            # drop "electrode_number" and "app_res" columns
-
-            df.drop(["electrode_number", "app_res"], axis=1, inplace=True)
-
-            df_new = pd.DataFrame(columns=["electrode", "elevation"])
-            electrode = df[['A', 'B', 'M', 'N']].values.ravel()
-            elevation = df[['A_ele', 'B_elv', 'M_elv', 'N_elv']].values.ravel()
+def electrode_table(inv):
+    """Returns the (electrode, elevation) table of a parsed .INV file.
+
+    Uses the topography section when there is one, the electrodes of the
+    measurement block otherwise.
+    """
+    if inv.topography is not None:
+        return pd.DataFrame(inv.topography, columns=["electrode", "elevation"])
+
+    df_new = pd.DataFrame(columns=["electrode", "elevation"])
+    electrode, elevation = electrode_positions(inv.measurements)
+    return my_fun(df_new, electrode, elevation)
+
+
+# File extension and writer of each per-file output format; xlsx is the
+# legacy format read back by older versions of the app
+OUTPUT_FORMATS = {
+    "xlsx": (".xlsx", lambda df, path: df.to_excel(path, index=False)),
+    "parquet": (".parquet", lambda df, path: df.to_parquet(path, index=False)),
+    "feather": (".feather", lambda df, path: df.to_feather(path)),
+    "csv": (".csv", lambda df, path: df.to_csv(path, index=False)),
+}
+
+# One Parquet dataset for the whole batch, partitioned by source file. Each
+# input writes its own partition, so the dataset can be updated per file.
+# Partitions are named after the input's path relative to the directory,
+# URI-escaped as pyarrow's hive partitioning expects, so inputs with the
+# same name in different subdirectories do not share a partition.
+DATASET_FORMAT = "dataset"
+DATASET_NAME = "electrode_elevation.parquet"
+
+# Records each processed input and its output, for incremental reruns
+MANIFEST_NAME = ".electrode_elevation_manifest.json"
+
+
+def output_path(inv_file, output_format="xlsx", directory=None):
+    if output_format == DATASET_FORMAT:
+        # hive-style partition under `directory`, read back as a "source" column
+        source = os.path.relpath(inv_file, directory).replace(os.sep, "/")
+        return os.path.join(directory, DATASET_NAME,
+                            f"source={quote(source, safe='')}", "part-0.parquet")
+    # same directory as the input, with -elevation added to the file name
+    file_name = os.path.splitext(os.path.basename(inv_file))[0]
+    file_name = file_name + "-elevation" + OUTPUT_FORMATS[output_format][0]
+    return os.path.join(os.path.dirname(inv_file), file_name)
 
-            df_new = my_fun(df_new, electrode, elevation)
 
-        # save the df_new to excel file in the same directory as an excel file but add -elevation to the file name
+def process_inv_file(inv_file, output_format="xlsx", directory=None):
+    """Extracts the electrode elevations of one .INV file and writes them next to it.
 
-    file_name = os.path.splitext(os.path.basename(inv_file))[0]
-    file_name = file_name + "-elevation.xlsx"
-    file_name = os.path.join(os.path.dirname(inv_file), file_name)
+    For the dataset format the table is written as the file's partition of
+    the dataset in `directory`. Returns the path of the written file.
+    """
+    df_new = electrode_table(read_inv(inv_file))
 
-    df_new.to_excel(file_name, index=False)
+    file_name = output_path(inv_file, output_format, directory)
+    if output_format == DATASET_FORMAT:
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        df_new.to_parquet(file_name, index=False)
+    else:
+        OUTPUT_FORMATS[output_format][1](df_new, file_name)
+    return file_name
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    # write-then-rename so an interrupted run never leaves a truncated manifest
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def manifest_output(entry, directory):
+    # outputs are stored relative to the target directory, like the keys
+    return os.path.join(directory, entry["output"])
+
+
+def plan_incremental(inv_files, directory, manifest, output_format):
+    """Splits `inv_files` into the ones to (re)process and the unchanged ones.
+
+    A file is unchanged when the manifest has an output of the same format
+    that still exists, and its size and mtime match, or, failing the mtime,
+    its content hash matches. Returns (stale, unchanged, deleted), where
+    `deleted` lists the manifest keys whose input no longer exists.
+    """
+    stale, unchanged = [], []
+    for inv_file in inv_files:
+        key = os.path.relpath(inv_file, directory)
+        entry = manifest.get(key)
+        signature = file_signature(inv_file)
+        if (entry is None or entry["format"] != output_format
+                or not os.path.exists(manifest_output(entry, directory))
+                or entry["size"] != signature["size"]):
+            stale.append(inv_file)
+        elif entry["mtime_ns"] == signature["mtime_ns"]:
+            unchanged.append(inv_file)
+        elif entry["hash"] == file_hash(inv_file):
+            # touched but not modified
+            entry.update(signature)
+            unchanged.append(inv_file)
+        else:
+            stale.append(inv_file)
+
+    current = {os.path.relpath(f, directory) for f in inv_files}
+    deleted = sorted(key for key in manifest if key not in current)
+    return stale, unchanged, deleted
+
+
+def remove_output(path):
+    if os.path.exists(path):
+        os.remove(path)
+    parent = os.path.dirname(path)
+    # drop the dataset partition, and the dataset itself, once empty
+    if (os.path.basename(parent).startswith("source=") and os.path.isdir(parent)
+            and not os.listdir(parent)):
+        os.rmdir(parent)
+        dataset = os.path.dirname(parent)
+        if os.path.isdir(dataset) and not os.listdir(dataset):
+            os.rmdir(dataset)
+
+
+def _process_safely(inv_file, output_format="xlsx", directory=None):
+    # Runs in a worker: errors are returned, not raised, so one bad file
+    # does not abort the whole batch
+    try:
+        return inv_file, process_inv_file(inv_file, output_format, directory), None
+    except Exception as e:
+        return inv_file, None, f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+
+
+def process_batch(inv_files, workers=None, output_format="xlsx", directory=None):
+    """Processes `inv_files` on a pool of `workers` processes.
+
+    Returns a list of (inv_file, output_file, error) in the order of
+    `inv_files`; exactly one of output_file and error is None.
+    """
+    total = len(inv_files)
+    results = {}
+
+    if workers == 1:
+        completed = (_process_safely(f, output_format, directory) for f in inv_files)
+        for done, result in enumerate(completed, start=1):
+            results[result[0]] = result
+            _report_progress(done, total, result)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_process_safely, f, output_format, directory)
+                       for f in inv_files]
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                results[result[0]] = result
+                _report_progress(done, total, result)
+
+    return [results[f] for f in inv_files]
+
+
+def _report_progress(done, total, result):
+    inv_file, _, error = result
+    status = "failed" if error else "ok"
+    print(f"[{done}/{total}] {status}: {inv_file}", flush=True)
+
+
+def print_summary(results):
+    failed = [(inv_file, error) for inv_file, _, error in results if error]
+    print(f"\nProcessed {len(results)} files: "
+          f"{len(results) - len(failed)} succeeded, {len(failed)} failed")
+    for inv_file, error in failed:
+        print(f"\n{inv_file}\n  {error.splitlines()[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write an electrode elevation table for every .INV file in a directory. "
+        "Only files that are new or changed since the last run are processed.")
+    # You can specify the directory path if needed
+    parser.add_argument("directory", nargs="?",
+                        default=r"C:\Users\kalho\Downloads\Processed_Data\Inversion")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: one per CPU, 1 disables the pool).")
+    parser.add_argument("-f", "--format", default="xlsx",
+                        choices=[*OUTPUT_FORMATS, DATASET_FORMAT],
+                        help="Output format: one -elevation file per input, or a single Parquet "
+                        f"dataset ({DATASET_NAME}) partitioned by source file.")
+    parser.add_argument("--force", action="store_true",
+                        help=f"Ignore {MANIFEST_NAME} and reprocess every file.")
+    args = parser.parse_args()
+
+    manifest_path = os.path.join(args.directory, MANIFEST_NAME)
+    manifest = {} if args.force else load_manifest(manifest_path)
+
+    inv_files = read_inv_files(args.directory)
+    stale, unchanged, deleted = plan_incremental(
+        inv_files, args.directory, manifest, args.format)
+
+    # outputs of inputs that no longer exist
+    for key in deleted:
+        remove_output(manifest_output(manifest.pop(key), args.directory))
+
+    results = process_batch(stale, workers=args.workers,
+                            output_format=args.format, directory=args.directory)
+
+    for inv_file, output_file, error in results:
+        key = os.path.relpath(inv_file, args.directory)
+        old_entry = manifest.pop(key, None)
+        if old_entry is not None:
+            old_output = manifest_output(old_entry, args.directory)
+            if output_file is None or os.path.normpath(old_output) != os.path.normpath(output_file):
+                # e.g. the output format changed
+                remove_output(old_output)
+        if error is None:
+            manifest[key] = {**file_signature(inv_file), "hash": file_hash(inv_file),
+                             "format": args.format,
+                             "output": os.path.relpath(output_file, args.directory)}
+    save_manifest(manifest, manifest_path)
+
+    print(f"\n{len(unchanged)} unchanged files skipped, "
+          f"{len(deleted)} outputs of deleted files removed")
+    print_summary(results)
+    return 1 if any(error for _, _, error in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,60 @@
+import numpy as np
+from matplotlib.tri import Triangulation
+
+from cache import array_fingerprint
+
+
+def edge_length_mask(x, z, triangles, alpha, chunk_size=1 << 18):
+    """Flags triangles whose longest side is bigger than `alpha`.
+
+    Compares squared side lengths against alpha**2, gathering each vertex
+    coordinate once per chunk of triangles, so peak memory stays bounded
+    by `chunk_size` instead of growing with the mesh.
+    """
+    alpha2 = alpha * alpha
+    mask = np.empty(len(triangles), dtype=bool)
+    for start in range(0, len(triangles), chunk_size):
+        tri = triangles[start:start + chunk_size]
+        # float64 side lengths even for float32 coordinates, so the mask
+        # does not depend on the storage precision
+        xt = x[tri].astype(float, copy=False)
+        zt = z[tri].astype(float, copy=False)
+        out = mask[start:start + chunk_size]
+        out[:] = False
+        for i, j in ((0, 1), (1, 2), (2, 0)):
+            dx = xt[:, i] - xt[:, j]
+            dz = zt[:, i] - zt[:, j]
+            dx *= dx
+            dz *= dz
+            dx += dz
+            out |= dx > alpha2
+    return mask
+
+
+def compute_geometry(x, z, alpha):
+    """Runs the Delaunay triangulation and the edge-length mask."""
+    triangles = Triangulation(x, z).triangles
+    mask = edge_length_mask(x, z, triangles, alpha)
+    return triangles, mask
+
+
+def build_triangulation(x, z, alpha, cache=None, key=None):
+    """Returns a masked Triangulation of (x, z).
+
+    The triangles and mask are memoized in `cache` by a fingerprint of the
+    coordinates and `alpha`, so reruns that only change plot styling skip
+    Delaunay entirely and just wrap the cached arrays. Callers that already
+    know a fingerprint of the coordinates can pass it as `key` to skip
+    hashing them again.
+    """
+    if cache is None:
+        triangles, mask = compute_geometry(x, z, alpha)
+    else:
+        if key is None:
+            key = array_fingerprint(x, z)
+        key = ('geometry', key, alpha)
+        triangles, mask = cache.get_or_compute(
+            key, lambda: compute_geometry(x, z, alpha))
+    triang = Triangulation(x, z, triangles=triangles)
+    triang.set_mask(mask)
+    return triang
@@ -0,0 +1,149 @@
+"""Per-stage timing and memory instrumentation.
+
+Hot paths are wrapped in `with stage(name, **sizes)`. This is a no-op
+unless a Recorder is active in the current context, e.g. for one Streamlit
+rerun, so batch workers and the command-line tools pay nothing. Each
+recorded stage has its wall time, its input sizes and, when memory
+tracing is on, the bytes it allocated. Finished reruns are logged as one
+JSON line on the "ert.metrics" logger.
+"""
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import marshal
+import pstats
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger('ert.metrics')
+
+_recorder = contextvars.ContextVar('recorder', default=None)
+
+# tracemalloc is process-wide and reruns of different sessions share the
+# process: only one memory-tracing recorder may own it at a time
+_trace_lock = threading.Lock()
+
+
+class Recorder:
+    """Stage records of one run, e.g. one Streamlit rerun.
+
+    With `trace_memory`, tracemalloc runs while the recorder is active;
+    this slows Python-heavy stages noticeably, so it is off by default.
+    Traced runs are serialised, one at a time per process; allocations of
+    untraced runs in other threads still count towards their numbers.
+    `context` is added to the logged summary, e.g. a session id.
+    """
+
+    def __init__(self, trace_memory=False, context=None):
+        self.trace_memory = trace_memory
+        self.context = context or {}
+        self.records = []
+        self.seconds = None
+        self._depth = 0
+        # running tracemalloc peak of every open stage, see stage()
+        self._peaks = []
+
+    @contextlib.contextmanager
+    def activate(self):
+        with _trace_lock if self.trace_memory else contextlib.nullcontext():
+            token = _recorder.set(self)
+            started = self.trace_memory and not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                with stage('total'):
+                    yield self
+            finally:
+                self.seconds = time.perf_counter() - start
+                if started:
+                    tracemalloc.stop()
+                _recorder.reset(token)
+                logger.info(json.dumps(self.summary(), default=str))
+
+    def summary(self):
+        return {'event': 'rerun', 'seconds': self.seconds, **self.context,
+                'stages': self.records}
+
+
+@contextlib.contextmanager
+def stage(name, **sizes):
+    """Records the wall time and allocations of the enclosed block.
+
+    `sizes` describe the input, e.g. points=..., and are stored with the
+    record. Stages nest; `depth` in the record gives the nesting level.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        yield
+        return
+
+    # only the recorder holding _trace_lock traces; the global tracer
+    # may be running for another session's rerun
+    tracing = recorder.trace_memory and tracemalloc.is_tracing()
+    if tracing:
+        # tracemalloc has a single peak counter: fold it into the enclosing
+        # stage's running peak before resetting it for this stage
+        current, peak = tracemalloc.get_traced_memory()
+        if recorder._peaks:
+            recorder._peaks[-1] = max(recorder._peaks[-1], peak)
+        recorder._peaks.append(current)
+        tracemalloc.reset_peak()
+
+    record = {'stage': name, 'depth': recorder._depth, **sizes}
+    recorder.records.append(record)
+    recorder._depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        recorder._depth -= 1
+        if tracing:
+            end, peak = tracemalloc.get_traced_memory()
+            peak = max(recorder._peaks.pop(), peak)
+            if recorder._peaks:
+                recorder._peaks[-1] = max(recorder._peaks[-1], peak)
+            record['peak_bytes'] = peak - current
+            record['net_bytes'] = end - current
+
+
+@contextlib.contextmanager
+def profiled():
+    """Runs the enclosed block under cProfile; yields the Profile."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+
+
+def profile_report(profile, limit=30, sort='cumulative'):
+    """Text table of the `limit` most expensive functions."""
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def profile_bytes(profile):
+    """The profile in the .prof format read by pstats and snakeviz."""
+    return marshal.dumps(pstats.Stats(profile).stats)
+
+
+def configure_logging(destination):
+    """Sends the metrics log to a file, or to stderr for "-".
+
+    Only the first call adds a handler, so it is safe on every rerun.
+    """
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler() if destination == '-' else logging.FileHandler(destination)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
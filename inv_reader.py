@@ -0,0 +1,87 @@
+"""Single-pass reader for RES2DINV-style .INV files.
+
+The file is streamed once: the header gives the number of measurement
+rows, the measurement block is converted in bulk with np.loadtxt, and the
+rest of the file is scanned for the "TOPOGRAPHICAL DATA" section.
+"""
+import os
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+
+TOPOGRAPHY_HEADER = "TOPOGRAPHICAL DATA"
+
+# 0-indexed line holding the number of measurements, and the number of
+# header lines before the first measurement
+MEASUREMENT_COUNT_LINE = 6
+MEASUREMENT_START = 9
+
+# Electrode position columns of the 8- (A, M, N) and 10-column (A, B, M, N)
+# measurement layouts; each is followed by its elevation column
+ELECTRODE_COLUMNS = {
+    8: [1, 3, 5],
+    10: [1, 3, 5, 7],
+}
+
+InvData = namedtuple('InvData', ['measurements', 'topography'])
+
+
+def _to_array(lines, usecols=None):
+    return np.loadtxt(list(lines), usecols=usecols, ndmin=2)
+
+
+def parse_inv(lines):
+    """Parses an iterable of text lines into an InvData.
+
+    `measurements` is an (n, 8) or (n, 10) array, `topography` an (n, 2)
+    array of (x, elevation), or None when the file has no topography
+    section. A malformed measurement block only raises when there is no
+    topography to fall back on.
+    """
+    lines = iter(lines)
+    measurements = None
+    error = None
+    try:
+        header = list(islice(lines, MEASUREMENT_START))
+        count = int(header[MEASUREMENT_COUNT_LINE].strip())
+        measurements = _to_array(islice(lines, count))
+    except (ValueError, IndexError) as e:
+        error = e
+
+    topography = None
+    for line in lines:
+        if TOPOGRAPHY_HEADER in line:
+            # skip one line and read the number of rows
+            next(lines)
+            count = int(next(lines).strip())
+            topography = _to_array(islice(lines, count), usecols=(0, 1))
+            break
+
+    if topography is None and measurements is None:
+        raise ValueError(f"invalid measurement block: {error}")
+    return InvData(measurements, topography)
+
+
+def read_inv(source):
+    """Reads a .INV file from a path or a text file-like object."""
+    if isinstance(source, (str, os.PathLike)):
+        # latin-1 like the app's upload path, so stray non-ASCII bytes in
+        # header lines never fail to decode whatever the locale
+        with open(source, 'r', encoding='latin-1') as f:
+            return parse_inv(f)
+    return parse_inv(source)
+
+
+def electrode_positions(measurements):
+    """Returns the (positions, elevations) of every electrode of every measurement.
+
+    Electrodes are listed row by row, in A, (B,) M, N order.
+    """
+    ncols = measurements.shape[1]
+    if ncols not in ELECTRODE_COLUMNS:
+        raise ValueError(f"expected 8 or 10 measurement columns, found {ncols}")
+    columns = ELECTRODE_COLUMNS[ncols]
+    positions = measurements[:, columns].ravel()
+    elevations = measurements[:, [c + 1 for c in columns]].ravel()
+    return positions, elevations
@@ -0,0 +1,145 @@
+import os
+import zipfile
+from io import BytesIO, TextIOWrapper
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from cache import content_hash
+from create_electrode_elevation import electrode_table
+from instrument import stage
+from inv_reader import read_inv
+
+# Extensions handled by load_inv rather than load_table
+INV_EXTENSIONS = ('inv', 'zip')
+
+
+def to_numeric_frame(df):
+    """Casts every text column that is fully numeric to float64.
+
+    Columns that are already numeric are kept as they are, and a frame
+    with nothing to convert is returned without a copy, e.g. most Parquet
+    and Feather uploads. Columns holding text (e.g. notes) are left
+    untouched so the sidebar preview still shows them.
+    """
+    converted_columns = {}
+    for name in df.columns:
+        if pd.api.types.is_numeric_dtype(df[name]):
+            continue
+        converted = pd.to_numeric(df[name], errors='coerce')
+        if converted.isna().sum() == df[name].isna().sum():
+            converted_columns[name] = converted.to_numpy(dtype=np.float64)
+    if not converted_columns:
+        return df
+    # a shallow copy shares the unchanged columns with `df`
+    df = df.copy(deep=False)
+    for name, values in converted_columns.items():
+        df[name] = values
+    return df
+
+
+# Reader of each tabular upload format, by file extension. The columnar
+# formats load straight into NumPy-backed columns without openpyxl.
+TABLE_READERS = {
+    'xlsx': lambda f: pd.read_excel(f, engine='openpyxl'),
+    'xls': lambda f: pd.read_excel(f, engine='openpyxl'),
+    'parquet': pd.read_parquet,
+    'feather': pd.read_feather,
+    'arrow': pd.read_feather,
+    'csv': pd.read_csv,
+}
+TABLE_EXTENSIONS = tuple(TABLE_READERS)
+
+
+def file_extension(name):
+    return name.rsplit('.', 1)[-1].lower()
+
+
+def read_table_bytes(data, extension='xlsx'):
+    """Parses the raw bytes of an uploaded table into a numeric frame."""
+    df = TABLE_READERS[extension](BytesIO(data))
+    return to_numeric_frame(df)
+
+
+def load_table(uploaded_file, cache):
+    """Returns the parsed table for an upload, re-parsing only when its content changes."""
+    data = uploaded_file.getvalue()
+    extension = file_extension(uploaded_file.name)
+    key = ('table', extension, content_hash(data))
+    with stage('read_table', format=extension, bytes=len(data)):
+        return cache.get_or_compute(key, lambda: read_table_bytes(data, extension))
+
+
+def _first_parquet_columns(f, n):
+    parquet_file = pq.ParquetFile(f)
+    return parquet_file.read(columns=parquet_file.schema_arrow.names[:n]).to_pandas()
+
+
+# Readers of only the x, elevation and resistivity columns, the first
+# three of a data table, for the compact data path
+SECTION_READERS = {
+    'xlsx': lambda f: pd.read_excel(f, engine='openpyxl', usecols=[0, 1, 2]),
+    'xls': lambda f: pd.read_excel(f, engine='openpyxl', usecols=[0, 1, 2]),
+    'parquet': lambda f: _first_parquet_columns(f, 3),
+    'feather': lambda f: feather.read_table(f, columns=[0, 1, 2]).to_pandas(),
+    'arrow': lambda f: feather.read_table(f, columns=[0, 1, 2]).to_pandas(),
+    'csv': lambda f: pd.read_csv(f, usecols=[0, 1, 2]),
+}
+
+
+def read_section_bytes(data, extension='xlsx'):
+    """Parses only the x, elevation and resistivity columns, as float32.
+
+    The columns share one Fortran-ordered float32 block, so each is
+    contiguous and the frame's to_numpy() is a view, not a copy.
+    Resistivity stays linear: the contours interpolate it linearly and
+    the stages that work in log space take the log themselves.
+    """
+    df = SECTION_READERS[extension](BytesIO(data))
+    values = np.empty((len(df), 3), dtype=np.float32, order='F')
+    for i in range(3):
+        values[:, i] = pd.to_numeric(df.iloc[:, i], errors='coerce')
+    return pd.DataFrame(values, columns=df.columns[:3], copy=False)
+
+
+def load_section(uploaded_file, cache):
+    """Compact counterpart of load_table: the three section columns as float32."""
+    data = uploaded_file.getvalue()
+    extension = file_extension(uploaded_file.name)
+    key = ('section', extension, content_hash(data))
+    with stage('read_section', format=extension, bytes=len(data)):
+        return cache.get_or_compute(key, lambda: read_section_bytes(data, extension))
+
+
+def file_stem(name):
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def _inv_table(f):
+    # .INV files are plain ASCII numbers; latin-1 never fails on stray bytes
+    return electrode_table(read_inv(TextIOWrapper(f, encoding='latin-1')))
+
+
+def read_inv_bytes(data, name):
+    """Electrode tables of a .INV file, or a zip of .INV files, keyed by file stem."""
+    if zipfile.is_zipfile(BytesIO(data)):
+        tables = {}
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            for member in sorted(archive.namelist()):
+                if member.upper().endswith('.INV'):
+                    with archive.open(member) as f:
+                        tables[file_stem(member)] = _inv_table(f)
+        if not tables:
+            raise ValueError(f"no .INV files in {name}")
+        return tables
+    return {file_stem(name): _inv_table(BytesIO(data))}
+
+
+def load_inv(uploaded_file, cache):
+    """Returns the electrode tables of an uploaded .INV or zip, parsed in memory."""
+    data = uploaded_file.getvalue()
+    key = ('inv', content_hash(data), uploaded_file.name)
+    with stage('read_inv', bytes=len(data)):
+        return cache.get_or_compute(key, lambda: read_inv_bytes(data, uploaded_file.name))
@@ -1,15 +1,20 @@
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib
-import numpy as np
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
-from matplotlib.tri import Triangulation
-from scipy.ndimage import gaussian_filter
-from io import BytesIO
 
 import hmac
+import os
+import uuid
+
+from batch import BATCH_FORMATS, pair_profiles, profile_values, render_batch
+from cache import DiskStore, LRUCache, content_hash
+from instrument import (Recorder, configure_logging, profile_bytes,
+                        profile_report, profiled, stage)
+from loaders import (INV_EXTENSIONS, TABLE_EXTENSIONS, file_extension,
+                     file_stem, load_inv, load_section, load_table)
+from pipeline import (PREVIEW_DPI, PREVIEW_POINT_BUDGET, RENDER_SETTINGS,
+                      STYLE_SETTINGS, build_geometry, decimate_section,
+                      export_figure, figure_key, fully_masked, prepare_section,
+                      preview_alpha, render_figure, section_contours)
+from webgl_preview import colormap_luts, preview_html, section_payload
 
 
 st.set_page_config(page_title="National Rocks", layout="wide")
@@ -66,351 +71,513 @@ if 'df' not in st.session_state:
 if "df_electrode_locations" not in st.session_state:
     st.session_state.df_electrode_locations = None
 
+# Set to a directory to also keep the shared caches on disk, so they
+# survive restarts and are shared between server processes
+CACHE_DIR = os.environ.get("ERT_CACHE_DIR")
+
+
+@st.cache_resource
+def shared_caches():
+    """Caches shared by every session of this server process.
+
+    All keys are content hashes of the uploads and settings, so sessions
+    that open the same profile reuse each other's parsed tables,
+    triangulations, contour paths and exports. Each cache is bounded, so
+    the total memory stays fixed however many users are connected.
+    """
+    def disk(name):
+        return DiskStore(os.path.join(CACHE_DIR, name)) if CACHE_DIR else None
+
+    return {
+        # Parsed tables keyed by upload content, so reruns skip openpyxl
+        "parse": LRUCache(max_entries=32, max_bytes=1024 * 2**20, disk=disk("parse")),
+        # Triangles and edge-length masks keyed by a fingerprint of (x, z, alpha)
+        "geometry": LRUCache(max_entries=16, max_bytes=1024 * 2**20, disk=disk("geometry")),
+        # Smoothed sections and extracted contour paths, see pipeline.py
+        "stage": LRUCache(max_entries=64, max_bytes=1024 * 2**20, disk=disk("stage")),
+        # Downloaded figure bytes keyed by (figure state, format, dpi)
+        "export": LRUCache(max_entries=32, max_bytes=512 * 2**20),
+    }
+
+
+caches = shared_caches()
+
+# One JSON line per rerun with the time and memory of every stage, to a
+# file or "-" for stderr
+if os.environ.get("ERT_METRICS_LOG"):
+    configure_logging(os.environ["ERT_METRICS_LOG"])
+
+
+# Define file formats and their properties
+FILE_FORMATS = {
+    "png": {"label": "Download Plot as PNG", "mime": 'image/png'},
+    "pdf": {"label": "Download Plot as PDF", "mime": 'application/pdf'},
+    "svg": {"label": "Download Plot as SVG", "mime": 'image/svg+xml'},
+}
+
+# Matplotlib colormaps offered in the plot settings
+COLOR_MAPS = ['viridis', 'plasma', 'inferno', 'magma', 'cividis',
+              'Greys', 'Purples', 'Blues', 'Greens', 'Oranges', 'Reds',
+              'YlOrBr', 'YlOrRd', 'OrRd', 'PuRd', 'RdPu', 'BuPu',
+              'GnBu', 'PuBu', 'YlGnBu', 'PuBuGn', 'BuGn', 'YlGn',
+              'binary', 'gist_yarg', 'gist_gray', 'gray', 'bone',
+              'pink', 'spring', 'summer', 'autumn', 'winter', 'cool',
+              'Wistia', 'hot', 'afmhot', 'gist_heat', 'copper',
+              'twilight', 'twilight_shifted', 'hsv',
+              'ocean', 'gist_earth', 'terrain',
+              'gist_stern', 'gnuplot', 'gnuplot2', 'CMRmap',
+              'cubehelix', 'brg', 'gist_rainbow', 'rainbow', 'jet',
+              'turbo', 'nipy_spectral', 'gist_ncar',
+              ]
+
+# Canvas height of the interactive preview, in pixels
+WEBGL_HEIGHT = 500
+
+PREVIEW_MODES = {
+    'static': 'Static image',
+    'webgl': 'Interactive (WebGL)',
+}
+
+
+def plot_settings_form():
+    """Plot settings shared by the single-profile view and batch mode."""
+    with st.expander("Plot settings"):
+        with st.form(key='my_form', border=False):
+            st.write("Please enter the parameters for the plots")
+
+            st.slider('Smoothing (m)', 0.0, 10.0, 0.0, 0.1, key='smoothing',
+                      help='Radius of the Gaussian smoothing applied to log-resistivity on a regular grid. '
+                      'Zero plots the raw model cells.',
+                      )
 
-def main():
-    st.title("National Rocks ERT Data Analysis")
-    st.write("This is a web application to analyze ERT data built by National Rocks")
-    st.write("Please upload an Excel file to analyze the data")
-    st.write(
-        "The Excel file should contain the following columns as the first three columns:")
-    st.write("x, elevation, resistivity")
-
-    # Upload Excel file through Streamlit's file uploader
-    with st.sidebar:
-        uploaded_file = st.file_uploader(
-            "Choose an Excel file", type=["xlsx", "xls"])
-
-        if uploaded_file is not None:
-            st.toast('Excel file uploaded successfully', icon='😍')
-
-            # Use Pandas to read the Excel file
-            try:
-                df = pd.read_excel(uploaded_file, engine='openpyxl')
-                st.session_state.df = df
-                st.dataframe(df)  # Display the DataFrame in Streamlit
-
-                upload_file_elevation = st.file_uploader(
-                    "Choose an Excel file for electrode elevation", type=["xlsx", "xls"])
-
-                if upload_file_elevation is not None:
-
-                    df_electrode_locations = pd.read_excel(
-                        upload_file_elevation, engine='openpyxl')
-                    st.session_state.df_electrode_locations = df_electrode_locations
-                    st.dataframe(df_electrode_locations)
+            st.number_input('Mask edge length (m)', 0.1, 1000.0, 10.0, 1.0, key='mask_alpha',
+                            help='Triangles with a side longer than this are left blank, '
+                            'e.g. gaps between model cells below the survey.')
+
+            st.divider()
+            st.slider('Number of contours', 2, 50, 20, 1, key='number_of_contours',
+                      help='Specify the number of contour lines to be displayed.')
+            st.slider('Main contour line width', 0.1, 1.0, 0.5, 0.05,
+                      key='main_contour_lw', help='Set the width of the main contour lines.')
+            st.slider('Bold contour line width', 0.1, 2.0, 1.0, 0.05,
+                      key='bold_contour_lw', help='Set the width of the bold contour lines.')
+            st.slider('Font size contour label', 2, 20, 10, 1, key='fontsize_contour_label',
+                      help='Adjust the font size of the contour labels.')
+
+            st.slider('Skip contour label every nth contour', 1, 5, 1, 1, key='skip_contour_every_nth',
+                      help='Specify the interval for skipping contour labels. This is useful when there are too many contour lines')
+            st.slider('Contour bold every nth', 1, 10, 5, 1, key='contour_bold_every_nth',
+                      help='Specify the interval for making contour lines bold.')
+
+            # Add help text to the selectbox
+            st.selectbox('Color map', COLOR_MAPS, index=COLOR_MAPS.index(
+                'rainbow'), key='color_map', help='Choose a color map for the plot.')
+
+            st.link_button(
+                'Color map reference', 'https://matplotlib.org/stable/users/explain/colors/colormaps.html')
+
+            # Add help text to the checkbox
+            st.checkbox('Plot aspect ratio equal', value=True,
+                        help='Check to make the plot aspect ratio equal so that one unit on the x-axis is equal to one unit on the y-axis', key='aspect_ratio_equal')
+
+            st.divider()
+
+            col1_width, col2_height, dpi = st.columns(3)
+
+            with col1_width:
+                st.number_input(
+                    'Figure width (inches)',
+                    1,
+                    100,
+                    20,
+                    1,
+                    key='figure_width_inches',
+                    help="Specify the width of the figure in inches. This is useful when the figure is too small or too large."
+                    "Increase the the width if the length of the x-axis is too large."
+                    "Decrease the width if the length of the x-axis is too small."
+                )
 
-            except Exception as e:
-                st.toast('Error: Please upload a valid Excel file', icon='🤯')
-        else:
-            st.info("Please upload an Excel file.")
-
-    if st.session_state.df is not None and st.session_state.df_electrode_locations is not None:
-
-        with st.expander("Plot settings"):
-            with st.form(key='my_form', border=False):
-                st.write("Please enter the parameters for the plots")
-
-                st.slider('Smoothing', 0.0, 10.0, 0.0, 0.1, key='smoothing',
-                          help='Adjust the level of smoothing applied to the data.',
-                          )
-
-                st.divider()
-                st.slider('Number of contours', 2, 50, 20, 1, key='number_of_contours',
-                          help='Specify the number of contour lines to be displayed.')
-                st.slider('Main contour line width', 0.1, 1.0, 0.5, 0.05,
-                          key='main_contour_lw', help='Set the width of the main contour lines.')
-                st.slider('Bold contour line width', 0.1, 2.0, 1.0, 0.05,
-                          key='bold_contour_lw', help='Set the width of the bold contour lines.')
-                st.slider('Font size contour label', 2, 20, 10, 1, key='fontsize_contour_label',
-                          help='Adjust the font size of the contour labels.')
-
-                st.slider('Skip contour label every nth contour', 1, 5, 1, 1, key='skip_contour_every_nth',
-                          help='Specify the interval for skipping contour labels. This is useful when there are too many contour lines')
-                st.slider('Contour bold every nth', 1, 10, 5, 1, key='contour_bold_every_nth',
-                          help='Specify the interval for making contour lines bold.')
-
-                color_map_mat = ['viridis', 'plasma', 'inferno', 'magma', 'cividis',
-                                 'Greys', 'Purples', 'Blues', 'Greens', 'Oranges', 'Reds',
-                                 'YlOrBr', 'YlOrRd', 'OrRd', 'PuRd', 'RdPu', 'BuPu',
-                                 'GnBu', 'PuBu', 'YlGnBu', 'PuBuGn', 'BuGn', 'YlGn',
-                                 'binary', 'gist_yarg', 'gist_gray', 'gray', 'bone',
-                                 'pink', 'spring', 'summer', 'autumn', 'winter', 'cool',
-                                 'Wistia', 'hot', 'afmhot', 'gist_heat', 'copper',
-                                 'twilight', 'twilight_shifted', 'hsv',
-                                 'ocean', 'gist_earth', 'terrain',
-                                 'gist_stern', 'gnuplot', 'gnuplot2', 'CMRmap',
-                                 'cubehelix', 'brg', 'gist_rainbow', 'rainbow', 'jet',
-                                 'turbo', 'nipy_spectral', 'gist_ncar',
-                                 ]
-
-                # Add help text to the selectbox
-                st.selectbox('Color map', color_map_mat, index=color_map_mat.index(
-                    'rainbow'), key='color_map', help='Choose a color map for the plot.')
-
-                st.link_button(
-                    'Color map reference', 'https://matplotlib.org/stable/users/explain/colors/colormaps.html')
-
-                # Add help text to the checkbox
-                st.checkbox('Plot aspect ratio equal', value=True,
-                            help='Check to make the plot aspect ratio equal so that one unit on the x-axis is equal to one unit on the y-axis', key='aspect_ratio_equal')
-
-                st.divider()
-
-                col1_width, col2_height, dpi = st.columns(3)
-
-                with col1_width:
-                    st.number_input(
-                        'Figure width (inches)',
-                        1,
-                        100,
-                        20,
-                        1,
-                        key='figure_width_inches',
-                        help="Specify the width of the figure in inches. This is useful when the figure is too small or too large."
-                        "Increase the the width if the length of the x-axis is too large."
-                        "Decrease the width if the length of the x-axis is too small."
-                    )
-
-                with col2_height:
-                    st.number_input(
-                        'Figure height (inches)',
-                        1,
-                        100,
-                        8,
-                        1,
-                        key='figure_height_inches',
-                        help="Specify the height of the figure in inches. This is useful when the figure is too small or too large."
-                        "Increase the the height if the length of the y-axis is too large."
-                        "Decrease the height if the length of the y-axis is too small."
-                    )
-
-                with dpi:
-                    st.number_input(
-                        'Figure dpi',
-                        50,
-                        1000,
-                        300,
-                        130,
-                        key='figure_dpi',
-                        help="Specify the resolution of the figure. This is useful when the figure is too small or too large."
-                    )
-                col1, col2, col3 = st.columns(3)
-
-                with col1:
-                    st.number_input(
-                        'Electrode marker size', 1, 60, 20, 1, key='electrode_marker_size',
-                        help="Specify the size of the electrode markers."
-                    )
-                with col2:
-                    st.number_input(
-                        "Tick label font size", 1, 40, 10, 1, key='tick_label_font_size',
-                        help="Specify the font size of the tick labels."
-                    )
-
-                with col3:
-                    st.number_input(
-                        "Axis label font size", 1, 60, 14, 1, key='axis_label_font_size',
-                        help="Specify the font size of the axis labels."
-                    )
-
-                st.divider()
-
-                col1_xtick_number_bins, col2_ytick_number_bins = st.columns(
-                    2)
-
-                with col1_xtick_number_bins:
-                    st.number_input(
-                        "Number of x tick bins", 1, 100, 30, 1, key='x_tick_step_size',
-                        help="Specify the number of bins for the x-axis."
-                    )
-
-                with col2_ytick_number_bins:
-                    st.number_input(
-                        "Number of y tick bins", 1, 100, 10, 1, key='y_tick_step_size',
-                        help="Specify the number of bins for the y-axis."
-                    )
-
-                st.checkbox(
-                    'Show grids', value=True, key='show_grids',
-                    help="Check to show grids on the plot."
+            with col2_height:
+                st.number_input(
+                    'Figure height (inches)',
+                    1,
+                    100,
+                    8,
+                    1,
+                    key='figure_height_inches',
+                    help="Specify the height of the figure in inches. This is useful when the figure is too small or too large."
+                    "Increase the the height if the length of the y-axis is too large."
+                    "Decrease the height if the length of the y-axis is too small."
                 )
 
-                st.divider()
-
-                # Define file formats and their properties
-                file_formats = {
-                    "png": {"label": "Download Plot as PNG", "mime": 'image/png'},
-                    "pdf": {"label": "Download Plot as PDF", "mime": 'application/pdf'},
-                    "svg": {"label": "Download Plot as SVG", "mime": 'image/svg+xml'},
-                }
-
-                st.radio(
-                    "Select file format:",
-                    list(file_formats.keys()),
-                    index=2,
-                    key='selected_format',
-                    help="Select the file format to save the plot.",
-                    horizontal=True
+            with dpi:
+                st.number_input(
+                    'Figure dpi',
+                    50,
+                    1000,
+                    300,
+                    130,
+                    key='figure_dpi',
+                    help="Specify the resolution of the figure. This is useful when the figure is too small or too large."
                 )
+            st.number_input(
+                'Preview point budget',
+                10_000,
+                5_000_000,
+                PREVIEW_POINT_BUDGET,
+                10_000,
+                key='preview_point_budget',
+                help="Sections with more model cells than this are binned to this many points for the on-screen preview. "
+                "Downloads always use the full-resolution mesh."
+            )
 
-                st.divider()
-                st.form_submit_button(label='Click to apply changes')
+            col1, col2, col3 = st.columns(3)
 
-        st.title("Data plots")
+            with col1:
+                st.number_input(
+                    'Electrode marker size', 1, 60, 20, 1, key='electrode_marker_size',
+                    help="Specify the size of the electrode markers."
+                )
+            with col2:
+                st.number_input(
+                    "Tick label font size", 1, 40, 10, 1, key='tick_label_font_size',
+                    help="Specify the font size of the tick labels."
+                )
 
-        data = st.session_state.df.to_numpy()
+            with col3:
+                st.number_input(
+                    "Axis label font size", 1, 60, 14, 1, key='axis_label_font_size',
+                    help="Specify the font size of the axis labels."
+                )
 
-        data[:, 2] = gaussian_filter(
-            data[:, 2], sigma=st.session_state.smoothing)
+            st.divider()
 
-        x = data[:, 0]
-        z = data[:, 1]
-        rho = data[:, 2]
+            col1_xtick_number_bins, col2_ytick_number_bins = st.columns(
+                2)
 
-        clevels = np.logspace(np.log10(np.min(rho)),
-                              np.log10(np.max(rho)),
-                              num=st.session_state.number_of_contours, base=10)
+            with col1_xtick_number_bins:
+                st.number_input(
+                    "Number of x tick bins", 1, 100, 30, 1, key='x_tick_step_size',
+                    help="Specify the number of bins for the x-axis."
+                )
 
-        triang = Triangulation(x, z)
+            with col2_ytick_number_bins:
+                st.number_input(
+                    "Number of y tick bins", 1, 100, 10, 1, key='y_tick_step_size',
+                    help="Specify the number of bins for the y-axis."
+                )
 
-        def apply_mask(triang, alpha=0.4):
-            # Mask triangles with sidelength bigger some alpha
-            triangles = triang.triangles
-            # Mask off unwanted triangles.
-            xtri = x[triangles] - np.roll(x[triangles], 1, axis=1)
-            ytri = z[triangles] - np.roll(z[triangles], 1, axis=1)
-            maxi = np.max(np.sqrt(xtri**2 + ytri**2), axis=1)
-            # apply masking
-            triang.set_mask(maxi > alpha)
+            st.checkbox(
+                'Show grids', value=True, key='show_grids',
+                help="Check to show grids on the plot."
+            )
 
-        apply_mask(triang, alpha=10)
+            st.divider()
 
-        fig, ax = plt.subplots(
-            facecolor='white', edgecolor='white',
-            figsize=(st.session_state['figure_width_inches'],
-                     st.session_state['figure_height_inches']),
-            dpi=st.session_state['figure_dpi']
-        )
+            st.radio(
+                "Select file format:",
+                list(FILE_FORMATS.keys()),
+                index=2,
+                key='selected_format',
+                help="Select the file format to save the plot.",
+                horizontal=True
+            )
 
-        # Basic contour lines
-        cs = ax.tricontour(triang, rho, levels=clevels,
-                           colors='k',
-                           linewidths=st.session_state.main_contour_lw,
-                           )
-        cc = ax.tricontourf(triang, rho, levels=clevels, cmap=st.session_state.color_map,
-                            norm=matplotlib.colors.LogNorm(vmin=rho.min(), vmax=rho.max()))
-
-        # Create labels for each contour line
-        # labels = [str(level) for level in cs.levels]
-        # Label every other level using strings
-        clabels = ax.clabel(
-            cs, cs.levels[::st.session_state.skip_contour_every_nth], inline=True, fmt='%0.0f', colors='k',
-            fontsize=st.session_state.fontsize_contour_label,
+            st.divider()
+            st.form_submit_button(label='Click to apply changes')
+
+
+def batch_export(data_files, electrode_files):
+    """Renders every uploaded profile with the current plot settings."""
+    st.title("Batch export")
+    cache = caches["parse"]
+    try:
+        data_tables = {file_stem(f.name): load_table(f, cache) for f in data_files}
+        electrode_tables = {}
+        for f in electrode_files:
+            if file_extension(f.name) in INV_EXTENSIONS:
+                electrode_tables.update(load_inv(f, cache))
+            else:
+                electrode_tables[file_stem(f.name)] = load_table(f, cache)
+    except Exception as e:
+        st.error(f"Could not read the batch files: {e}")
+        return
+
+    pairs, unpaired = pair_profiles(data_tables, electrode_tables)
+    if unpaired:
+        st.warning(f"No electrode file for: {', '.join(unpaired)}")
+
+    file_format = st.session_state.selected_format
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        bundle = st.radio(
+            'Output', BATCH_FORMATS, horizontal=True, key='batch_bundle',
+            format_func={'zip': f'Zip of {file_format.upper()} files', 'pdf': 'Multi-page PDF'}.get)
+    with col2:
+        st.checkbox('Shared colour scale', key='batch_shared_scale',
+                    help="Use the same resistivity range, and so the same contour levels and colours, "
+                    "for every profile.")
+    with col3:
+        st.number_input('Workers', 1, os.cpu_count() or 1, os.cpu_count() or 1, 1,
+                        key='batch_workers',
+                        help="Number of profiles rendered in parallel.")
+
+    # Everything the rendered bundle depends on; a stored render is only
+    # offered for download while it still matches
+    settings = {name: st.session_state[name] for name in RENDER_SETTINGS}
+    batch_key = (
+        tuple((f.name, content_hash(f.getvalue())) for f in data_files),
+        tuple((f.name, content_hash(f.getvalue())) for f in electrode_files),
+        tuple(settings.items()), bundle, file_format, st.session_state.figure_dpi,
+        st.session_state.batch_shared_scale)
+
+    if st.button(f"Render {len(pairs)} profiles", disabled=not pairs):
+        profiles = [(name, profile_values(data), electrodes)
+                    for name, data, electrodes in pairs]
+        with st.spinner(f"Rendering {len(profiles)} profiles..."):
+            st.session_state.batch_result = (batch_key, render_batch(
+                profiles, settings, bundle=bundle, file_format=file_format,
+                dpi=st.session_state.figure_dpi,
+                shared_scale=st.session_state.batch_shared_scale,
+                workers=st.session_state.batch_workers))
+
+    if st.session_state.get('batch_result') is not None:
+        rendered_key, data = st.session_state.batch_result
+        if rendered_key != batch_key:
+            st.info("The files or settings changed since the last render. "
+                    "Render again to download the batch.")
+            return
+        st.download_button(
+            label=f"Download batch as {bundle.upper()}",
+            data=data,
+            file_name=f"ert_batch.{bundle}",
+            mime='application/zip' if bundle == 'zip' else 'application/pdf',
+            on_click='ignore',
         )
 
-        # Make every fifth contour line and label bold
-        for i, (clabel, contour_line) in enumerate(zip(clabels, cs.collections)):
-            if (i + 1) % st.session_state.contour_bold_every_nth == 0:
-                clabel.set_fontweight('bold')
-                contour_line.set_linewidth(st.session_state.bold_contour_lw)
-
-        ax.scatter(st.session_state.df_electrode_locations.iloc[:, 0],
-                   st.session_state.df_electrode_locations.iloc[:, 1],
-                   marker="v",
-                   color='r',
-                   s=st.session_state.electrode_marker_size,
-                   )
-
-        if st.session_state.aspect_ratio_equal:
-            ax.set_aspect(
-                aspect='equal', adjustable='box')
-
-        ax.set_xlabel('Distance (m)',
-                      fontsize=st.session_state.axis_label_font_size
-                      )
-        ax.set_ylabel('Elevation (m)',
-                      fontsize=st.session_state.axis_label_font_size
-                      )
 
-        # Limit x and y axes to range to fit data
-        x_range = x.max() - x.min()
-        y_range = max(triang.y) - min(triang.y)
-        ax.set_xlim([x.min() - 0.01 * x_range, x.max() + 0.01 * x_range])
-        ax.set_ylim([min(triang.y) - 0.1 * y_range,
-                    max(triang.y) + 0.2 * y_range])
-
-        ax.xaxis.set_minor_locator(matplotlib.ticker.AutoMinorLocator())
-        ax.yaxis.set_minor_locator(matplotlib.ticker.AutoMinorLocator())
-
-        ax.tick_params(axis='both', which='major',
-                       labelsize=st.session_state.tick_label_font_size)
-        ax.tick_params(axis='both', which='minor',
-                       labelsize=st.session_state.tick_label_font_size,
-                       length=2
-                       )
-
-        ax.set_title(
-            f'ERT Data for {uploaded_file.name.split(".")[0]}',
-            fontsize=st.session_state.axis_label_font_size+2
-        )
+def main():
+    st.title("National Rocks ERT Data Analysis")
+    st.write("This is a web application to analyze ERT data built by National Rocks")
+    st.write("Please upload an Excel, Parquet, Feather or CSV file to analyze the data")
+    st.write(
+        "The file should contain the following columns as the first three columns:")
+    st.write("x, elevation, resistivity")
 
-        # locator_params
-        ax.locator_params(axis='x', nbins=st.session_state.x_tick_step_size)
-        ax.locator_params(axis='y', nbins=st.session_state.y_tick_step_size)
+    # Upload the data file through Streamlit's file uploader
+    with st.sidebar:
+        uploaded_file = st.file_uploader(
+            "Choose an Excel, Parquet, Feather or CSV file", type=list(TABLE_EXTENSIONS))
 
-        if st.session_state.show_grids:
-            ax.grid(
-                linestyle='--',
-                linewidth=0.5,
-            )
+        if uploaded_file is not None:
+            st.toast('File uploaded successfully', icon='😍')
+            compact = st.checkbox(
+                'Compact data (float32)', key='compact_data',
+                help="Reads only the x, elevation and resistivity columns, as float32. "
+                "Uses a quarter to half the memory for large sections. Rounding to float32 "
+                "can move contour labels slightly on noisy sections.")
+
+            # Use Pandas to read the file
+            try:
+                load = load_section if compact else load_table
+                df = load(uploaded_file, caches["parse"])
+                st.session_state.df = df
+                st.dataframe(df)  # Display the DataFrame in Streamlit
 
-        # Add colorbar
-        divider = make_axes_locatable(ax)
-        cax = divider.append_axes("right", size="0.6%", pad=0.02)
-        # ax_pos = ax.get_position()
+                upload_file_elevation = st.file_uploader(
+                    "Choose a table, .INV file or zip of .INV files for electrode elevation",
+                    type=[*TABLE_EXTENSIONS, *INV_EXTENSIONS])
 
-        # Define the inset_axes parameters with absolute width
-        # cax_width = 0.05  # Adjust the width as needed
-        # cax = inset_axes(ax, width="10%", height="100%",
-        #                  loc='center right',
-        #                  bbox_to_anchor=(0.935, 0, 0.08, 1.0),
-        #                  bbox_transform=ax.transAxes)
-        cbar = fig.colorbar(cc, cax=cax, format="%.0f")
+                if upload_file_elevation is not None:
 
-        # Adjust the position of the original axis to make room for the colorbar
-        # ax.set_position([ax_pos.x0, ax_pos.y0, ax_pos.width - cax_width, ax_pos.height])
+                    if file_extension(upload_file_elevation.name) in INV_EXTENSIONS:
+                        # Electrode elevations are extracted in memory, no
+                        # -elevation.xlsx round-trip needed
+                        tables = load_inv(
+                            upload_file_elevation, caches["parse"])
+                        profiles = list(tables)
+                        stem = file_stem(uploaded_file.name)
+                        profile = st.selectbox(
+                            'Electrode profile', profiles,
+                            index=profiles.index(stem) if stem in profiles else 0,
+                            disabled=len(profiles) == 1)
+                        df_electrode_locations = tables[profile]
+                    else:
+                        df_electrode_locations = load_table(
+                            upload_file_elevation, caches["parse"])
+                    st.session_state.df_electrode_locations = df_electrode_locations
+                    st.dataframe(df_electrode_locations)
 
-        cbar.set_label('Resistivity (Ω.m)',
-                       fontsize=st.session_state.axis_label_font_size)
-        cbar.ax.tick_params(labelsize=st.session_state.tick_label_font_size)
+            except Exception as e:
+                st.toast('Error: Please upload a valid table or .INV file', icon='🤯')
+        else:
+            st.info("Please upload a data file.")
+
+        cache_stats = caches["parse"].stats()
+        shared_bytes = sum(cache.nbytes for cache in caches.values())
+        st.caption(
+            f"Parse cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries. "
+            f"Shared caches hold {shared_bytes / 2**20:.1f} MiB across all sessions.")
+
+        st.divider()
+        st.subheader("Batch mode")
+        batch_data_files = st.file_uploader(
+            "Data files for batch plotting", type=list(TABLE_EXTENSIONS),
+            accept_multiple_files=True,
+            help="Profiles are paired with their electrode file by file name.")
+        batch_electrode_files = st.file_uploader(
+            "Electrode files for batch plotting", type=[*TABLE_EXTENSIONS, *INV_EXTENSIONS],
+            accept_multiple_files=True,
+            help="Tables named like the data file, optionally with an -elevation suffix, "
+            ".INV files or zips of .INV files.")
+
+    single_profile = (st.session_state.df is not None
+                      and st.session_state.df_electrode_locations is not None)
+
+    if single_profile or batch_data_files:
+        plot_settings_form()
+
+    if batch_data_files:
+        batch_export(batch_data_files, batch_electrode_files)
+
+    if single_profile:
 
-        image_bytes = BytesIO()
+        st.title("Data plots")
 
-        # Save plot to BytesIO object based on selected format
-        fig.savefig(image_bytes, format=st.session_state.selected_format,
-                    bbox_inches='tight', pad_inches=0.2, dpi=300
-                    )
-        image_bytes.seek(0)
+        # Outside the settings form so switching takes effect immediately
+        preview_mode = st.radio(
+            'Preview', list(PREVIEW_MODES), format_func=PREVIEW_MODES.get,
+            horizontal=True, key='preview_mode',
+            help="The interactive preview sends the mesh to the browser once; pan, zoom, "
+            "colour map and level changes are then drawn there without rerunning the app. "
+            "It shows the unsmoothed model cells without contour lines.")
+
+        # Each stage is cached on the settings it reads, so e.g. a font change
+        # reuses the triangulation, smoothed grid and contour paths
+        section = prepare_section(st.session_state.df.iloc[:, :3].to_numpy())
+        alpha = st.session_state.mask_alpha
+        smoothing = st.session_state.smoothing
+        number_of_contours = st.session_state.number_of_contours
+        budget = st.session_state.preview_point_budget
+
+        # The preview is drawn from a point cloud binned to the point budget;
+        # only the export below uses the full-resolution mesh
+        preview = decimate_section(section, budget, caches["stage"])
+        if preview is not section:
+            st.info(
+                f"Preview decimated from {section.x.size:,} to {preview.x.size:,} points. "
+                "Downloads use the full-resolution mesh.", icon='🔎')
+
+        geometry = build_geometry(
+            preview, preview_alpha(section, budget, alpha), caches["geometry"])
+        if fully_masked(geometry):
+            st.warning(
+                f"The mask edge length ({alpha:g} m) is below the cell spacing, so every "
+                "triangle is masked. Increase it in the plot settings.", icon='⚠️')
+            return
+
+        # Export bytes are only produced when the download is clicked, and
+        # cached per (figure state, format, dpi) so a repeat download is instant
+        style = {name: st.session_state[name] for name in STYLE_SETTINGS}
+        electrodes = st.session_state.df_electrode_locations
+        title = uploaded_file.name.split(".")[0]
+        file_format = st.session_state.selected_format
+        dpi = st.session_state.figure_dpi
+        data_key = (section.key, alpha, smoothing, number_of_contours)
+        export_key = (figure_key(data_key, electrodes, style, title), file_format, dpi)
+        export_cache = caches["export"]
+        geometry_cache = caches["geometry"]
+        stage_cache = caches["stage"]
+
+        def render_export():
+            full_contours = section_contours(
+                section, alpha, smoothing, number_of_contours, geometry_cache, stage_cache)
+            return export_figure(
+                render_figure(section, full_contours, electrodes, style, title, stage_cache),
+                file_format, dpi)
+
+        def export():
+            return export_cache.get_or_compute(export_key, render_export)
 
         # Get file format properties based on selected format
-        format_properties = file_formats[st.session_state.selected_format]
+        format_properties = FILE_FORMATS[file_format]
 
         # Add download button for the selected format
         st.download_button(
             label=format_properties["label"],
-            data=image_bytes,
-            file_name=f"{uploaded_file.name.split('.')[0]}.{st.session_state.selected_format}",
+            data=export,
+            file_name=f"{title}.{file_format}",
             mime=format_properties["mime"],
-            key=f'download_button_{st.session_state.selected_format}'
+            key=f'download_button_{file_format}'
         )
 
-        st.pyplot(fig,
-                  clear_figure=True,
-                  bbox_inches='tight',
-                  pad_inches=0.2,
-                  use_container_width=True
-                  )
+        if preview_mode == 'webgl':
+            with stage('webgl', points=preview.x.size):
+                payload = section_payload(geometry, preview, electrodes, stage_cache)
+                html = preview_html(payload, colormap_luts(COLOR_MAPS), st.session_state.color_map,
+                                    number_of_contours, height=WEBGL_HEIGHT)
+                st.iframe(html, height=WEBGL_HEIGHT + 70)
+            return
+
+        contours = section_contours(
+            preview, preview_alpha(section, budget, alpha), smoothing, number_of_contours,
+            caches["geometry"], caches["stage"])
+
+        fig = render_figure(preview, contours, electrodes, style, title, stage_cache)
+        # the preview is saved like the export, only at screen resolution
+        with stage('display', dpi=PREVIEW_DPI):
+            st.image(export_figure(fig, 'png', PREVIEW_DPI), width='stretch')
+
+
+def diagnostics_panel(recorder, profile=None):
+    """Stage timings of this rerun, cache usage and the optional profile."""
+    with st.sidebar:
+        st.checkbox('Show diagnostics', key='diagnostics',
+                    help="Time and memory of every stage of the last rerun.")
+    if not st.session_state.diagnostics:
+        return
+
+    with st.expander("Diagnostics", expanded=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.checkbox('Track memory', key='trace_memory',
+                        help="Record the bytes allocated by every stage. Slows reruns down.")
+        with col2:
+            st.button('Profile next rerun', key='profile_rerun',
+                      help="Rerun the app under cProfile and show where the time went.")
+
+        def sizes(record):
+            return ", ".join(f"{k}={v}" for k, v in record.items()
+                             if k not in ('stage', 'depth', 'seconds', 'peak_bytes', 'net_bytes'))
+
+        st.caption(f"Last rerun: {recorder.seconds:.3f} s")
+        st.dataframe([{
+            'stage': " " * r['depth'] + r['stage'],
+            'seconds': round(r['seconds'], 4),
+            'peak MiB': round(r['peak_bytes'] / 2**20, 2) if 'peak_bytes' in r else None,
+            'input': sizes(r),
+        } for r in recorder.records], hide_index=True, width='stretch')
+
+        st.dataframe([{'cache': name, **cache.stats()} for name, cache in caches.items()],
+                     hide_index=True, width='stretch')
+
+        if profile is not None:
+            st.code(profile_report(profile), language=None)
+            st.download_button('Download profile (.prof)', profile_bytes(profile),
+                               file_name='rerun.prof', on_click='ignore')
 
 
 if __name__ == "__main__":
-    main()
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex[:8]
+    recorder = Recorder(trace_memory=st.session_state.get('trace_memory', False),
+                        context={'session': st.session_state.session_id})
+    profile = None
+    with recorder.activate():
+        if st.session_state.get('profile_rerun'):
+            with profiled() as profile:
+                main()
+        else:
+            main()
+    diagnostics_panel(recorder, profile)
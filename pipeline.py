@@ -0,0 +1,549 @@
+"""Staged render pipeline for ERT sections.
+
+Each stage caches its output under a key built only from the inputs it
+depends on, so changing a styling widget reuses the triangulation, the
+smoothed grid and the extracted contour paths:
+
+    prepare_section  -> x, elevation, resistivity columns
+    decimate_section -> binned point cloud for the preview (large sections only)
+    build_geometry   -> triangulation and edge-length mask
+    smooth_on_grid   -> spatial smoothing on a regular grid (smoothing > 0)
+    extract_contours -> contour paths per level
+    label_contours   -> candidate label positions along the paths
+    render_figure    -> styling (not cached, cheap compared to the above)
+    export_figure    -> file bytes, only produced when a download is requested
+"""
+from collections import namedtuple
+from io import BytesIO
+
+import matplotlib
+import numpy as np
+from matplotlib.contour import ContourSet
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
+from matplotlib.path import Path
+from matplotlib.textpath import TextToPath
+from matplotlib.tri import LinearTriInterpolator
+from mpl_toolkits.axes_grid1 import make_axes_locatable
+from scipy.ndimage import gaussian_filter
+
+from cache import array_fingerprint
+from geometry import build_triangulation
+from instrument import stage
+
+# session_state keys read by each cached stage
+GEOMETRY_SETTINGS = ('mask_alpha',)
+PREP_SETTINGS = ('smoothing',)
+CONTOUR_SETTINGS = ('number_of_contours',)
+STYLE_SETTINGS = (
+    'main_contour_lw', 'bold_contour_lw', 'fontsize_contour_label',
+    'skip_contour_every_nth', 'contour_bold_every_nth', 'color_map',
+    'aspect_ratio_equal', 'figure_width_inches', 'figure_height_inches',
+    'electrode_marker_size', 'tick_label_font_size', 'axis_label_font_size',
+    'x_tick_step_size', 'y_tick_step_size', 'show_grids',
+)
+RENDER_SETTINGS = GEOMETRY_SETTINGS + PREP_SETTINGS + CONTOUR_SETTINGS + STYLE_SETTINGS
+
+# Resolution of the on-screen preview; exports use the figure dpi setting
+PREVIEW_DPI = 100
+
+# Upper bound on the number of nodes of the smoothing grid
+MAX_GRID_NODES = 1_000_000
+
+# Default number of points the preview is decimated to
+PREVIEW_POINT_BUDGET = 200_000
+
+# `key` fingerprints all three columns, `coords_key` only x and elevation,
+# so a new resistivity model on the same mesh reuses the triangulation
+Section = namedtuple('Section', ['key', 'coords_key', 'x', 'z', 'rho'])
+Geometry = namedtuple('Geometry', ['key', 'triang'])
+Grid = namedtuple('Grid', ['key', 'x', 'z', 'rho'])
+Contours = namedtuple('Contours', ['key', 'levels', 'lines', 'fills'])
+# Measures label text without a renderer
+TEXT_TO_PATH = TextToPath()
+
+# One candidate label per contour segment: the level index, the vertex
+# before the segment's midpoint, how far along that edge the midpoint is,
+# and the point itself
+Labels = namedtuple('Labels', ['key', 'level', 'vertex', 'fraction', 'x', 'z'])
+
+
+def prepare_section(values):
+    """Data-prep stage: splits the (x, elevation, resistivity) columns.
+
+    float32 values, from the compact data path, stay float32 without a
+    copy; anything else is converted to float64.
+    """
+    with stage('prepare', points=len(values)):
+        values = np.asarray(values)
+        dtype = np.float32 if values.dtype == np.float32 else float
+        data = np.asarray(values[:, :3], dtype=dtype)
+        return Section(array_fingerprint(data), array_fingerprint(data[:, :2]),
+                       data[:, 0], data[:, 1], data[:, 2])
+
+
+def _bin_shape(x, z, budget):
+    """Number and size of bins so that about `budget` of them cover the section."""
+    width = max(np.ptp(x), 1e-9)
+    height = max(np.ptp(z), 1e-9)
+    nx = max(int(np.sqrt(budget * width / height)), 1)
+    nz = max(budget // nx, 1)
+    return nx, nz, width / nx, height / nz
+
+
+def compute_decimated(section, budget):
+    """Averages the points falling into each of about `budget` bins.
+
+    Resistivity is averaged in log space (geometric mean).
+    """
+    x, z, rho = section.x, section.z, section.rho
+    nx, nz, dx, dz = _bin_shape(x, z, budget)
+    ix = np.minimum(((x - x.min()) / dx).astype(np.intp), nx - 1)
+    iz = np.minimum(((z - z.min()) / dz).astype(np.intp), nz - 1)
+    _, inverse, counts = np.unique(ix * nz + iz, return_inverse=True, return_counts=True)
+
+    def mean(values):
+        return np.bincount(inverse, weights=values) / counts
+
+    return np.column_stack([mean(x), mean(z), 10 ** mean(np.log10(rho))])
+
+
+def decimate_section(section, budget, cache):
+    """Preview stage: bins sections larger than `budget` points to screen resolution.
+
+    Returns `section` unchanged when it already fits the budget.
+    """
+    if section.x.size <= budget:
+        return section
+    key = ('decimated', section.key, budget)
+    with stage('decimate', points=section.x.size, budget=budget):
+        data = cache.get_or_compute(key, lambda: compute_decimated(section, budget))
+    # the bin means of x and elevation depend on the coordinates only
+    coords_key = ('decimated', section.coords_key, budget)
+    return Section(key, coords_key, data[:, 0], data[:, 1], data[:, 2])
+
+
+def preview_alpha(section, budget, alpha):
+    """Edge-length threshold for a section decimated to `budget` points.
+
+    Bins can be wider than `alpha`, so the threshold grows with the bin
+    size to keep the mask from removing the whole preview.
+    """
+    if section.x.size <= budget:
+        return alpha
+    _, _, dx, dz = _bin_shape(section.x, section.z, budget)
+    return max(alpha, 2 * np.hypot(dx, dz))
+
+
+def build_geometry(section, alpha, cache):
+    """Geometry stage: depends on the coordinates only."""
+    with stage('geometry', points=section.x.size):
+        triang = build_triangulation(
+            section.x, section.z, alpha, cache=cache, key=section.coords_key)
+    return Geometry((section.coords_key, alpha), triang)
+
+
+def fully_masked(geometry):
+    """True when the mask leaves no triangle, e.g. an edge length below the cell spacing."""
+    return bool(np.all(geometry.triang.mask))
+
+
+def grid_spacing(triang, max_nodes=MAX_GRID_NODES):
+    """Cell size matching the mean point spacing of the unmasked mesh.
+
+    Coarsened if needed so the grid over the data extent stays under
+    `max_nodes`.
+    """
+    triangles = triang.get_masked_triangles()
+    extent = np.ptp(triang.x) * np.ptp(triang.y)
+    if len(triangles) == 0:
+        # no unmasked mesh to measure: the coarsest cell allowed, kept finite
+        return max(np.sqrt(extent / max_nodes), np.finfo(float).eps)
+    x = triang.x[triangles]
+    z = triang.y[triangles]
+    area = 0.5 * np.abs((x[:, 1] - x[:, 0]) * (z[:, 2] - z[:, 0])
+                        - (x[:, 2] - x[:, 0]) * (z[:, 1] - z[:, 0])).sum()
+    cell = np.sqrt(area / len(np.unique(triangles)))
+    return max(cell, np.sqrt(extent / max_nodes))
+
+
+def compute_grid(geometry, rho, sigma):
+    """Interpolates log10(rho) onto a regular grid and smooths it in 2D.
+
+    `sigma` is in metres. Nodes outside the masked triangulation stay
+    masked, and the Gaussian is normalised by the valid-node weights so
+    the edges of the section are not pulled towards zero.
+    """
+    triang = geometry.triang
+    cell = grid_spacing(triang)
+    xi = np.arange(triang.x.min(), triang.x.max() + cell, cell)
+    zi = np.arange(triang.y.min(), triang.y.max() + cell, cell)
+    xx, zz = np.meshgrid(xi, zi)
+    log_rho = LinearTriInterpolator(triang, np.log10(rho, dtype=float))(xx, zz)
+
+    valid = ~np.ma.getmaskarray(log_rho)
+    values = np.where(valid, log_rho.filled(0), 0)
+    weights = gaussian_filter(valid.astype(float), sigma=sigma / cell)
+    smoothed = gaussian_filter(values, sigma=sigma / cell)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        smoothed = smoothed / weights
+    return xi, zi, np.ma.masked_array(10 ** smoothed, mask=~valid)
+
+
+def smooth_on_grid(section, geometry, sigma, cache):
+    """Smoothing stage: the gridded, smoothed field, cached per sigma."""
+    key = ('grid', section.key, geometry.key, sigma)
+    with stage('smooth', points=section.x.size, sigma=sigma):
+        xi, zi, rho = cache.get_or_compute(
+            key, lambda: compute_grid(geometry, section.rho, sigma))
+    return Grid(key, xi, zi, rho)
+
+
+def contour_levels(rho, number_of_contours, value_range=None):
+    """Log-spaced levels over the range of `rho`, or over `value_range` when given.
+
+    A fixed `value_range` gives several sections the same colour scale.
+    """
+    vmin, vmax = value_range if value_range is not None else (np.min(rho), np.max(rho))
+    # float64 levels whatever the dtype of rho
+    vmin, vmax = float(vmin), float(vmax)
+    return np.logspace(np.log10(vmin),
+                       np.log10(vmax),
+                       num=number_of_contours, base=10)
+
+
+def _path_arrays(contour_set):
+    return [(path.vertices, path.codes) for path in contour_set.get_paths()]
+
+
+def compute_contours(surface, levels, key=None):
+    """Runs the contour generator once and keeps only the resulting paths.
+
+    `surface` is either a Geometry plus resistivity, contoured with
+    tricontour, or a Grid, contoured with contour.
+    """
+    ax = Figure().add_subplot()
+    if isinstance(surface, Grid):
+        args = (surface.x, surface.z, surface.rho)
+        contour, contourf = ax.contour, ax.contourf
+    else:
+        geometry, rho = surface
+        args = (geometry.triang, rho)
+        contour, contourf = ax.tricontour, ax.tricontourf
+    norm = matplotlib.colors.LogNorm(vmin=levels[0], vmax=levels[-1])
+    lines = contour(*args, levels=levels)
+    fills = contourf(*args, levels=levels, norm=norm)
+    return Contours(key, lines.levels, _path_arrays(lines), _path_arrays(fills))
+
+
+def extract_contours(section, geometry, number_of_contours, cache, grid=None,
+                     value_range=None):
+    """Contour-extraction stage: line and filled paths for every level.
+
+    Contours the smoothed grid when one is given, the raw mesh otherwise.
+    """
+    if grid is not None:
+        key = ('contours', grid.key, number_of_contours, value_range)
+        levels = contour_levels(grid.rho.compressed(), number_of_contours, value_range)
+        surface = grid
+    else:
+        key = ('contours', section.key, geometry.key, number_of_contours, value_range)
+        levels = contour_levels(section.rho, number_of_contours, value_range)
+        surface = (geometry, section.rho)
+    with stage('contours', points=section.x.size, levels=number_of_contours):
+        return cache.get_or_compute(
+            key, lambda: compute_contours(surface, levels, key=key))
+
+
+def section_contours(section, alpha, smoothing, number_of_contours,
+                     geometry_cache, stage_cache, value_range=None):
+    """Runs the geometry, smoothing and contour-extraction stages for a section.
+
+    Raises ValueError when the mask leaves no triangle to contour.
+    """
+    geometry = build_geometry(section, alpha, geometry_cache)
+    if fully_masked(geometry):
+        raise ValueError(f"mask edge length {alpha:g} is below the cell spacing; "
+                         "every triangle is masked")
+    grid = None
+    if smoothing > 0:
+        grid = smooth_on_grid(section, geometry, smoothing, stage_cache)
+    return extract_contours(section, geometry, number_of_contours, stage_cache,
+                            grid=grid, value_range=value_range)
+
+
+def _segment_starts(codes):
+    if codes is None:
+        return np.array([0])
+    return np.flatnonzero(codes == Path.MOVETO)
+
+
+def _arc_length(vertices, starts):
+    """Cumulative length along each segment; it does not grow across segment starts."""
+    steps = np.hypot(*np.diff(vertices, axis=0).T)
+    steps[starts[1:] - 1] = 0
+    return np.concatenate([[0], np.cumsum(steps)])
+
+
+def compute_labels(contours, skip):
+    """Midpoint of every segment of every `skip`-th level, in data coordinates."""
+    levels, vertex, fraction = [], [], []
+    for i in range(0, len(contours.levels), skip):
+        vertices, codes = contours.lines[i]
+        if len(vertices) < 2:
+            continue
+        starts = _segment_starts(codes)
+        arc = _arc_length(vertices, starts)
+        ends = np.append(starts[1:], len(vertices))
+        # a lone MOVETO has nowhere to put a label
+        starts, ends = starts[ends - starts > 1], ends[ends - starts > 1]
+        middle = (arc[starts] + arc[ends - 1]) / 2
+        j = np.clip(np.searchsorted(arc, middle, side='right') - 1, starts, ends - 2)
+        step = arc[j + 1] - arc[j]
+        levels.append(np.full(len(j), i))
+        vertex.append(j)
+        fraction.append(np.divide(middle - arc[j], step, out=np.zeros_like(step), where=step > 0))
+
+    if not levels:
+        empty = np.zeros(0)
+        return Labels((contours.key, skip), empty.astype(int), empty.astype(int), empty, empty, empty)
+    level, vertex, fraction = map(np.concatenate, (levels, vertex, fraction))
+    x, z = np.empty(len(level)), np.empty(len(level))
+    for i in np.unique(level):
+        vertices = contours.lines[i][0]
+        here = level == i
+        j, t = vertex[here], fraction[here]
+        x[here], z[here] = (vertices[j] + t[:, None] * (vertices[j + 1] - vertices[j])).T
+    return Labels((contours.key, skip), level, vertex, fraction, x, z)
+
+
+def label_contours(contours, skip, cache=None):
+    """Label-placement stage: candidate label positions, cached per level set.
+
+    Only positions along the paths are computed here; which candidates fit
+    and the gaps cut for them depend on the figure scale, see _draw_labels.
+    """
+    if cache is None:
+        return compute_labels(contours, skip)
+    return cache.get_or_compute(
+        ('labels', contours.key, skip), lambda: compute_labels(contours, skip))
+
+
+def _break_lines(vertices, codes, labels, widths, scale):
+    """Cuts a gap of `widths` points around each label into one level's path.
+
+    Returns the new vertices, with NaN separating the pieces, a mask of the
+    labels whose segment is long enough to hold them, and the angle of each
+    of those labels, following the chord across its gap.
+    """
+    display = vertices * scale
+    starts = _segment_starts(codes)
+    arc = _arc_length(display, starts)
+    segment = np.searchsorted(starts, labels.vertex, side='right') - 1
+    seg_start = arc[starts[segment]]
+    ends = np.append(starts[1:], len(vertices)) - 1
+    seg_end = arc[ends[segment]]
+
+    j, t = labels.vertex, labels.fraction
+    centre = arc[j] + t * (arc[j + 1] - arc[j])
+    fits = seg_end - seg_start > 1.2 * widths
+    centre, widths, segment = centre[fits], widths[fits], segment[fits]
+    # the midpoint is taken in data units, so with unequal axis scales the
+    # gap can reach past the segment's ends
+    lo = np.maximum(centre - widths / 2, seg_start[fits])
+    hi = np.minimum(centre + widths / 2, seg_end[fits])
+
+    def point_at(position):
+        k = np.clip(np.searchsorted(arc, position, side='right') - 1,
+                    starts[segment], ends[segment] - 1)
+        step = arc[k + 1] - arc[k]
+        f = np.divide(position - arc[k], step, out=np.zeros_like(step), where=step > 0)
+        return vertices[k] + f[:, None] * (vertices[k + 1] - vertices[k])
+
+    # drop the vertices inside a gap
+    inside = np.zeros(len(vertices) + 1, dtype=int)
+    np.add.at(inside, np.searchsorted(arc, lo, side='right'), 1)
+    np.add.at(inside, np.searchsorted(arc, hi, side='left'), -1)
+    keep = np.cumsum(inside)[:-1] == 0
+
+    # rebuild the path from the kept vertices, the gap ends and a NaN in
+    # each gap and before each segment, sorted by segment and arc length
+    is_start = np.zeros(len(vertices), dtype=int)
+    is_start[starts] = 1
+    vertex_segment = np.cumsum(is_start) - 1
+    nan = np.full((len(centre), 2), np.nan)
+    lo_point, hi_point = point_at(lo), point_at(hi)
+    points = np.concatenate([vertices[keep], lo_point, nan, hi_point,
+                             np.full((len(starts) - 1, 2), np.nan)])
+    order_segment = np.concatenate([vertex_segment[keep], segment, segment, segment,
+                                    np.arange(1, len(starts))])
+    order_arc = np.concatenate([arc[keep], lo, centre, hi, np.full(len(starts) - 1, -np.inf)])
+    tiebreak = np.concatenate([np.zeros(keep.sum()), np.full(len(centre), 1),
+                               np.full(len(centre), 2), np.full(len(centre), 3),
+                               np.zeros(len(starts) - 1)])
+    order = np.lexsort((tiebreak, order_arc, order_segment))
+
+    chord = (hi_point - lo_point) * scale
+    angle = np.degrees(np.arctan2(chord[:, 1], chord[:, 0]))
+    # keep the text upright
+    angle = (angle + 90) % 180 - 90
+    return points[order], fits, angle
+
+
+def _draw_labels(ax, contours, labels, settings, bold):
+    """Draws the labels that fit and returns the line paths with gaps cut for them."""
+    fig = ax.figure
+    ax.apply_aspect()
+    # points per data unit along x and z
+    origin, corner = ax.transData.transform([[0, 0], [1, 1]])
+    scale = (corner - origin) * 72 / fig.dpi
+
+    fontsize = settings['fontsize_contour_label']
+    paths = list(contours.lines)
+    for i in np.unique(labels.level):
+        here = labels.level == i
+        level_labels = Labels(labels.key, *(a[here] for a in labels[1:]))
+        text = f"{contours.levels[i]:0.0f}"
+        weight = 'bold' if bold[i] else 'normal'
+        width, _, _ = TEXT_TO_PATH.get_text_width_height_descent(
+            text, FontProperties(size=fontsize, weight=weight), ismath=False)
+        # the same padding as clabel's inline_spacing
+        widths = np.full(here.sum(), width + 2 * 5 * 72 / fig.dpi)
+        vertices, codes = contours.lines[i]
+        broken, fits, angle = _break_lines(vertices, codes, level_labels, widths, scale)
+        paths[i] = (broken, None)
+
+        for x, z, rotation in zip(level_labels.x[fits], level_labels.z[fits], angle):
+            ax.text(x, z, text, rotation=rotation, rotation_mode='anchor',
+                    ha='center', va='center', fontsize=fontsize, fontweight=weight,
+                    color='k', clip_on=True)
+    return paths
+
+
+def _contour_set(ax, levels, paths, **kwargs):
+    allsegs = [[vertices] for vertices, _ in paths]
+    allkinds = [[codes] for _, codes in paths]
+    return ContourSet(ax, levels, allsegs, allkinds, **kwargs)
+
+
+def render_figure(section, contours, electrodes, settings, title, label_cache=None):
+    """Styling stage: draws the cached contour paths with the current plot settings.
+
+    `settings` is anything indexable by the STYLE_SETTINGS keys (plus
+    'figure_dpi' when present), e.g. st.session_state. Label positions are
+    cached in `label_cache` when given.
+    """
+    with stage('render', points=section.x.size, levels=len(contours.levels)):
+        return _render_figure(section, contours, electrodes, settings, title, label_cache)
+
+
+def _render_figure(section, contours, electrodes, settings, title, label_cache):
+    x = section.x
+    z = section.z
+
+    fig = Figure(
+        facecolor='white', edgecolor='white',
+        figsize=(settings['figure_width_inches'],
+                 settings['figure_height_inches']),
+        dpi=settings.get('figure_dpi', PREVIEW_DPI)
+    )
+    ax = fig.add_subplot()
+
+    cc = _contour_set(ax, contours.levels, contours.fills, filled=True,
+                      cmap=settings['color_map'],
+                      norm=matplotlib.colors.LogNorm(vmin=contours.levels[0],
+                                                     vmax=contours.levels[-1]))
+
+    ax.scatter(electrodes.iloc[:, 0],
+               electrodes.iloc[:, 1],
+               marker="v",
+               color='r',
+               s=settings['electrode_marker_size'],
+               )
+
+    if settings['aspect_ratio_equal']:
+        ax.set_aspect(
+            aspect='equal', adjustable='box')
+
+    ax.set_xlabel('Distance (m)',
+                  fontsize=settings['axis_label_font_size']
+                  )
+    ax.set_ylabel('Elevation (m)',
+                  fontsize=settings['axis_label_font_size']
+                  )
+
+    # Limit x and y axes to range to fit data, in float64 whatever the
+    # dtype of the section
+    x_min, x_max, z_min, z_max = map(float, (x.min(), x.max(), z.min(), z.max()))
+    x_range = x_max - x_min
+    y_range = z_max - z_min
+    ax.set_xlim([x_min - 0.01 * x_range, x_max + 0.01 * x_range])
+    ax.set_ylim([z_min - 0.1 * y_range,
+                z_max + 0.2 * y_range])
+
+    ax.xaxis.set_minor_locator(matplotlib.ticker.AutoMinorLocator())
+    ax.yaxis.set_minor_locator(matplotlib.ticker.AutoMinorLocator())
+
+    ax.tick_params(axis='both', which='major',
+                   labelsize=settings['tick_label_font_size'])
+    ax.tick_params(axis='both', which='minor',
+                   labelsize=settings['tick_label_font_size'],
+                   length=2
+                   )
+
+    ax.set_title(
+        f'ERT Data for {title}',
+        fontsize=settings['axis_label_font_size']+2
+    )
+
+    ax.locator_params(axis='x', nbins=settings['x_tick_step_size'])
+    ax.locator_params(axis='y', nbins=settings['y_tick_step_size'])
+
+    if settings['show_grids']:
+        ax.grid(
+            linestyle='--',
+            linewidth=0.5,
+        )
+
+    # Add colorbar
+    divider = make_axes_locatable(ax)
+    cax = divider.append_axes("right", size="0.6%", pad=0.02)
+    cbar = fig.colorbar(cc, cax=cax, format="%.0f")
+
+    cbar.set_label('Resistivity (Ω.m)',
+                   fontsize=settings['axis_label_font_size'])
+    cbar.ax.tick_params(labelsize=settings['tick_label_font_size'])
+
+    # Contour lines and labels come last: the gaps cut for the labels
+    # depend on the final axes scale. Every nth level, counted over all
+    # levels, gets a bold line and a bold label.
+    bold = (np.arange(len(contours.levels)) + 1) % settings['contour_bold_every_nth'] == 0
+    with stage('labels'):
+        labels = label_contours(contours, settings['skip_contour_every_nth'], label_cache)
+        paths = _draw_labels(ax, contours, labels, settings, bold)
+    _contour_set(ax, contours.levels, paths, colors='k',
+                 linewidths=np.where(bold, settings['bold_contour_lw'], settings['main_contour_lw']))
+
+    return fig
+
+
+def figure_key(data_key, electrodes, settings, title):
+    """Fingerprint of everything that determines the rendered figure.
+
+    `data_key` identifies the contoured data, e.g. the section key plus
+    the geometry, smoothing and contour settings.
+    """
+    style = tuple((name, settings[name]) for name in STYLE_SETTINGS)
+    return array_fingerprint(
+        electrodes.iloc[:, :2].to_numpy(dtype=float),
+        extra=(data_key, style, title))
+
+
+def export_figure(fig, file_format, dpi):
+    """Export stage: the figure saved as `file_format` at `dpi`."""
+    image_bytes = BytesIO()
+    with stage('savefig', format=file_format, dpi=dpi):
+        fig.savefig(image_bytes, format=file_format,
+                    bbox_inches='tight', pad_inches=0.2, dpi=dpi
+                    )
+    return image_bytes.getvalue()
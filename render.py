@@ -0,0 +1,168 @@
+"""Headless plotting API and command line renderer.
+
+The same pipeline as the Streamlit app, without a browser session:
+
+    from render import PlotSettings, render_section
+    fig = render_section(values, electrodes, PlotSettings(smoothing=2.0), title='Line 1')
+
+or, for a whole directory of profiles:
+
+    python render.py DIRECTORY -o OUTPUT_DIR -f png -j 8
+"""
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+from batch import ELEVATION_SUFFIX, pair_profiles, profile_values, render_profiles
+from cache import LRUCache
+from loaders import (INV_EXTENSIONS, TABLE_EXTENSIONS, file_extension, file_stem,
+                     read_inv_bytes, read_table_bytes)
+from pipeline import export_figure, prepare_section, render_figure, section_contours
+
+
+@dataclass
+class PlotSettings:
+    """Plot settings, with the same defaults as the app's settings form.
+
+    Indexable by name like st.session_state, so it can be passed anywhere
+    the pipeline takes settings.
+    """
+    mask_alpha: float = 10.0
+    smoothing: float = 0.0
+    number_of_contours: int = 20
+    main_contour_lw: float = 0.5
+    bold_contour_lw: float = 1.0
+    fontsize_contour_label: int = 10
+    skip_contour_every_nth: int = 1
+    contour_bold_every_nth: int = 5
+    color_map: str = 'rainbow'
+    aspect_ratio_equal: bool = True
+    figure_width_inches: int = 20
+    figure_height_inches: int = 8
+    figure_dpi: int = 300
+    electrode_marker_size: int = 20
+    tick_label_font_size: int = 10
+    axis_label_font_size: int = 14
+    x_tick_step_size: int = 30
+    y_tick_step_size: int = 10
+    show_grids: bool = True
+    selected_format: str = 'svg'
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Settings from any mapping, e.g. parsed JSON; unknown keys are ignored."""
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in mapping.items() if k in names})
+
+
+def render_section(values, electrodes, settings=None, title='', value_range=None):
+    """Renders one section and returns the matplotlib Figure.
+
+    `values` is an (n, 3) array of x, elevation and resistivity, and
+    `electrodes` a frame whose first two columns are electrode x and
+    elevation.
+    """
+    settings = settings or PlotSettings()
+    section = prepare_section(np.asarray(values))
+    contours = section_contours(
+        section, settings.mask_alpha, settings.smoothing, settings.number_of_contours,
+        LRUCache(), LRUCache(), value_range)
+    return render_figure(section, contours, electrodes, settings, title)
+
+
+def render_to_bytes(values, electrodes, settings=None, title='', file_format=None, dpi=None):
+    """Renders one section straight to file bytes."""
+    settings = settings or PlotSettings()
+    fig = render_section(values, electrodes, settings, title)
+    return export_figure(fig, file_format or settings.selected_format, dpi or settings.figure_dpi)
+
+
+def read_file(path):
+    """Reads a data/electrode table, or the electrode tables of a .INV or zip.
+
+    Returns {file stem: frame}.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    extension = file_extension(path)
+    if extension in INV_EXTENSIONS:
+        return read_inv_bytes(data, os.path.basename(path))
+    return {file_stem(path): read_table_bytes(data, extension)}
+
+
+def find_profiles(directory):
+    """Pairs the data files in `directory` with their electrode files.
+
+    Electrode files are tables with the -elevation suffix, .INV files or
+    zips of them; every other table is a data file.
+    """
+    data_tables, electrode_tables = {}, {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        extension = file_extension(name)
+        if not os.path.isfile(path) or extension not in (*TABLE_EXTENSIONS, *INV_EXTENSIONS):
+            continue
+        if extension in INV_EXTENSIONS or file_stem(name).endswith(ELEVATION_SUFFIX):
+            electrode_tables.update(read_file(path))
+        else:
+            data_tables.update(read_file(path))
+    return pair_profiles(data_tables, electrode_tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render every profile in a directory with the app's plotting pipeline.")
+    parser.add_argument("directory",
+                        help="Directory with data tables and their electrode files.")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Output directory (default: the input directory).")
+    parser.add_argument("-f", "--format", default=None, choices=["png", "pdf", "svg"],
+                        help="Output format (default: from the settings).")
+    parser.add_argument("--dpi", type=int, default=None,
+                        help="Export resolution (default: from the settings).")
+    parser.add_argument("-s", "--settings", default=None,
+                        help="JSON file of plot settings, keyed like the app's settings form.")
+    parser.add_argument("--shared-scale", action="store_true",
+                        help="Use the same colour scale for every profile.")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: one per CPU, 1 disables the pool).")
+    args = parser.parse_args()
+
+    settings = PlotSettings()
+    if args.settings:
+        with open(args.settings, 'r') as f:
+            settings = PlotSettings.from_mapping(json.load(f))
+    file_format = args.format or settings.selected_format
+    dpi = args.dpi or settings.figure_dpi
+    output = args.output or args.directory
+    os.makedirs(output, exist_ok=True)
+
+    pairs, unpaired = find_profiles(args.directory)
+    for stem in unpaired:
+        print(f"skipped {stem}: no electrode file")
+
+    start = time.perf_counter()
+    profiles = [(name, profile_values(data), electrodes) for name, data, electrodes in pairs]
+    images = render_profiles(profiles, settings, file_format, dpi,
+                             shared_scale=args.shared_scale, workers=args.workers)
+    for (name, _, _), image in zip(profiles, images):
+        path = os.path.join(output, f"{name}.{file_format}")
+        with open(path, 'wb') as f:
+            f.write(image)
+        print(f"wrote {path}")
+    print(f"Rendered {len(profiles)} profiles in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
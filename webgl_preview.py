@@ -0,0 +1,260 @@
+"""Interactive WebGL preview of a triangulated section.
+
+The mesh is sent to the browser once as compact binary buffers (float32
+vertices and log10 resistivity, uint16/uint32 triangle indices, base64
+encoded). Colouring, contour banding, pan and zoom then happen client-side,
+so changing the colormap or the number of levels costs no server round trip.
+"""
+import base64
+import json
+from string import Template
+
+import matplotlib
+import numpy as np
+
+from cache import array_fingerprint
+
+
+def _b64(array):
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')
+
+
+def mesh_payload(triang, rho, electrodes):
+    """Binary buffers describing the unmasked triangles of `triang`.
+
+    Coordinates are shifted to the section's lower-left corner before the
+    float32 cast so large survey coordinates keep their precision.
+    """
+    triangles = triang.get_masked_triangles()
+    used = np.unique(triangles)
+    # drop vertices no triangle references and renumber
+    remap = np.zeros(len(triang.x), dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    index_type = np.uint16 if len(used) < 2**16 else np.uint32
+
+    x0, z0 = triang.x[used].min(), triang.y[used].min()
+    vertices = np.column_stack([triang.x[used] - x0, triang.y[used] - z0]).astype(np.float32)
+    log_rho = np.log10(rho[used]).astype(np.float32)
+    electrode_xz = np.column_stack([
+        electrodes.iloc[:, 0].to_numpy(dtype=float) - x0,
+        electrodes.iloc[:, 1].to_numpy(dtype=float) - z0]).astype(np.float32)
+
+    return {
+        'origin': [float(x0), float(z0)],
+        'extent': [float(vertices[:, 0].max()), float(vertices[:, 1].max())],
+        'range': [float(log_rho.min()), float(log_rho.max())],
+        'index32': index_type is np.uint32,
+        'vertices': _b64(vertices),
+        'values': _b64(log_rho),
+        'triangles': _b64(remap[triangles].astype(index_type)),
+        'electrodes': _b64(electrode_xz),
+    }
+
+
+def section_payload(geometry, section, electrodes, cache):
+    """mesh_payload of a pipeline Geometry, cached on the geometry, section and electrodes."""
+    # the geometry key covers the coordinates only; the payload also holds rho
+    key = ('webgl', geometry.key, section.key,
+           array_fingerprint(electrodes.iloc[:, :2].to_numpy(dtype=float)))
+    return cache.get_or_compute(
+        key, lambda: mesh_payload(geometry.triang, section.rho, electrodes))
+
+
+def colormap_luts(names, size=256):
+    """256-entry RGB lookup tables of matplotlib colormaps, base64 encoded."""
+    samples = np.linspace(0, 1, size)
+    return {name: _b64((matplotlib.colormaps[name](samples)[:, :3] * 255).astype(np.uint8))
+            for name in names}
+
+
+_HTML = Template('''
+<div id="ert" style="font-family: sans-serif; font-size: 13px;">
+  <div style="margin-bottom: 6px;">
+    Color map <select id="cmap"></select>
+    &nbsp; Levels <input id="levels" type="range" min="0" max="50" step="1">
+    <span id="levels-label"></span>
+    &nbsp; <button id="reset">Reset view</button>
+    <span style="color: #888;">&nbsp; drag to pan, scroll to zoom</span>
+  </div>
+  <canvas id="gl" style="width: 100%; height: ${height}px; border: 1px solid #ddd;"></canvas>
+  <div style="display: flex; align-items: center; gap: 6px; margin-top: 4px;">
+    <span id="vmin"></span>
+    <div id="bar" style="flex: 1; height: 12px;"></div>
+    <span id="vmax"></span>
+    <span>Resistivity (Ω.m)</span>
+  </div>
+</div>
+<script>
+const payload = ${payload};
+const luts = ${luts};
+const init = ${init};
+
+function decode(b64, Type) {
+  const bin = atob(b64);
+  const bytes = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+  return new Type(bytes.buffer);
+}
+
+const canvas = document.getElementById('gl');
+const gl = canvas.getContext('webgl', {antialias: true});
+const uint32 = payload.index32 && gl.getExtension('OES_element_index_uint');
+
+const vs = `
+  attribute vec2 a_pos; attribute float a_val;
+  uniform vec2 u_scale; uniform vec2 u_offset; uniform float u_point;
+  varying float v_val;
+  void main() {
+    v_val = a_val;
+    gl_Position = vec4(a_pos * u_scale + u_offset, 0.0, 1.0);
+    gl_PointSize = 7.0;
+  }`;
+const fs = `
+  precision mediump float;
+  varying float v_val;
+  uniform sampler2D u_lut; uniform float u_vmin; uniform float u_vmax;
+  uniform float u_levels; uniform float u_point;
+  void main() {
+    if (u_point > 0.5) { gl_FragColor = vec4(1.0, 0.0, 0.0, 1.0); return; }
+    float t = clamp((v_val - u_vmin) / (u_vmax - u_vmin), 0.0, 1.0);
+    if (u_levels > 0.0) t = (min(floor(t * u_levels), u_levels - 1.0) + 0.5) / u_levels;
+    gl_FragColor = texture2D(u_lut, vec2(t, 0.5));
+  }`;
+
+function shader(type, src) {
+  const s = gl.createShader(type);
+  gl.shaderSource(s, src);
+  gl.compileShader(s);
+  return s;
+}
+const program = gl.createProgram();
+gl.attachShader(program, shader(gl.VERTEX_SHADER, vs));
+gl.attachShader(program, shader(gl.FRAGMENT_SHADER, fs));
+gl.linkProgram(program);
+gl.useProgram(program);
+const u = name => gl.getUniformLocation(program, name);
+
+function buffer(target, data) {
+  const b = gl.createBuffer();
+  gl.bindBuffer(target, b);
+  gl.bufferData(target, data, gl.STATIC_DRAW);
+  return b;
+}
+const vertexBuffer = buffer(gl.ARRAY_BUFFER, decode(payload.vertices, Float32Array));
+const valueBuffer = buffer(gl.ARRAY_BUFFER, decode(payload.values, Float32Array));
+const electrodeBuffer = buffer(gl.ARRAY_BUFFER, decode(payload.electrodes, Float32Array));
+const indices = decode(payload.triangles, uint32 ? Uint32Array : Uint16Array);
+const indexBuffer = buffer(gl.ELEMENT_ARRAY_BUFFER, indices);
+const nElectrodes = decode(payload.electrodes, Float32Array).length / 2;
+const aPos = gl.getAttribLocation(program, 'a_pos');
+const aVal = gl.getAttribLocation(program, 'a_val');
+
+const lut = gl.createTexture();
+function setColormap(name) {
+  const rgb = decode(luts[name], Uint8Array);
+  gl.bindTexture(gl.TEXTURE_2D, lut);
+  gl.pixelStorei(gl.UNPACK_ALIGNMENT, 1);
+  gl.texImage2D(gl.TEXTURE_2D, 0, gl.RGB, rgb.length / 3, 1, 0, gl.RGB, gl.UNSIGNED_BYTE, rgb);
+  gl.texParameteri(gl.TEXTURE_2D, gl.TEXTURE_MIN_FILTER, gl.NEAREST);
+  gl.texParameteri(gl.TEXTURE_2D, gl.TEXTURE_MAG_FILTER, gl.NEAREST);
+  gl.texParameteri(gl.TEXTURE_2D, gl.TEXTURE_WRAP_S, gl.CLAMP_TO_EDGE);
+  gl.texParameteri(gl.TEXTURE_2D, gl.TEXTURE_WRAP_T, gl.CLAMP_TO_EDGE);
+  const stops = [];
+  for (let i = 0; i < rgb.length / 3; i += 16) stops.push(`rgb($${rgb[3*i]},$${rgb[3*i+1]},$${rgb[3*i+2]})`);
+  document.getElementById('bar').style.background = `linear-gradient(to right, $${stops.join(',')})`;
+}
+
+// view: data units per pixel and data coordinate at the canvas centre
+let view;
+function resetView() {
+  const [w, h] = payload.extent;
+  const perPixel = Math.max(w / canvas.clientWidth, h / canvas.clientHeight) * 1.05;
+  view = {perPixel: perPixel, cx: w / 2, cz: h / 2};
+}
+
+function draw() {
+  canvas.width = canvas.clientWidth * devicePixelRatio;
+  canvas.height = canvas.clientHeight * devicePixelRatio;
+  gl.viewport(0, 0, canvas.width, canvas.height);
+  gl.clearColor(1, 1, 1, 1);
+  gl.clear(gl.COLOR_BUFFER_BIT);
+  const sx = 2 / (view.perPixel * canvas.clientWidth);
+  const sz = 2 / (view.perPixel * canvas.clientHeight);
+  gl.uniform2f(u('u_scale'), sx, sz);
+  gl.uniform2f(u('u_offset'), -view.cx * sx, -view.cz * sz);
+  gl.uniform1f(u('u_vmin'), payload.range[0]);
+  gl.uniform1f(u('u_vmax'), payload.range[1]);
+  gl.uniform1f(u('u_levels'), Number(levels.value));
+
+  gl.uniform1f(u('u_point'), 0);
+  gl.bindBuffer(gl.ARRAY_BUFFER, vertexBuffer);
+  gl.enableVertexAttribArray(aPos);
+  gl.vertexAttribPointer(aPos, 2, gl.FLOAT, false, 0, 0);
+  gl.bindBuffer(gl.ARRAY_BUFFER, valueBuffer);
+  gl.enableVertexAttribArray(aVal);
+  gl.vertexAttribPointer(aVal, 1, gl.FLOAT, false, 0, 0);
+  gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, indexBuffer);
+  gl.drawElements(gl.TRIANGLES, indices.length, uint32 ? gl.UNSIGNED_INT : gl.UNSIGNED_SHORT, 0);
+
+  gl.uniform1f(u('u_point'), 1);
+  gl.disableVertexAttribArray(aVal);
+  gl.bindBuffer(gl.ARRAY_BUFFER, electrodeBuffer);
+  gl.vertexAttribPointer(aPos, 2, gl.FLOAT, false, 0, 0);
+  gl.drawArrays(gl.POINTS, 0, nElectrodes);
+}
+
+const cmap = document.getElementById('cmap');
+for (const name of Object.keys(luts)) cmap.add(new Option(name, name));
+cmap.value = init.cmap;
+cmap.onchange = () => { setColormap(cmap.value); draw(); };
+
+const levels = document.getElementById('levels');
+const levelsLabel = document.getElementById('levels-label');
+levels.value = init.levels;
+function showLevels() { levelsLabel.textContent = levels.value == 0 ? 'continuous' : levels.value; }
+levels.oninput = () => { showLevels(); draw(); };
+
+document.getElementById('vmin').textContent = Math.pow(10, payload.range[0]).toFixed(0);
+document.getElementById('vmax').textContent = Math.pow(10, payload.range[1]).toFixed(0);
+document.getElementById('reset').onclick = () => { resetView(); draw(); };
+
+let drag = null;
+canvas.onmousedown = e => { drag = [e.clientX, e.clientY]; };
+window.onmouseup = () => { drag = null; };
+window.onmousemove = e => {
+  if (!drag) return;
+  view.cx -= (e.clientX - drag[0]) * view.perPixel;
+  view.cz += (e.clientY - drag[1]) * view.perPixel;
+  drag = [e.clientX, e.clientY];
+  draw();
+};
+canvas.onwheel = e => {
+  e.preventDefault();
+  // zoom around the cursor
+  const rect = canvas.getBoundingClientRect();
+  const px = e.clientX - rect.left - rect.width / 2;
+  const pz = rect.height / 2 - (e.clientY - rect.top);
+  const factor = Math.exp(e.deltaY * 0.001);
+  view.cx += px * view.perPixel * (1 - factor);
+  view.cz += pz * view.perPixel * (1 - factor);
+  view.perPixel *= factor;
+  draw();
+};
+window.onresize = draw;
+
+setColormap(init.cmap);
+showLevels();
+resetView();
+draw();
+</script>
+''')
+
+
+def preview_html(payload, luts, color_map, levels, height=500):
+    """Self-contained HTML page showing the mesh, for st.iframe."""
+    return _HTML.substitute(
+        payload=json.dumps(payload),
+        luts=json.dumps(luts),
+        init=json.dumps({'cmap': color_map, 'levels': levels}),
+        height=height,
+    )